@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Async Instrument Controller
+# asyncio clients for SCPI instruments
+
+# ## API
+# Blocking communication is run on an executor with a single thread per instrument,
+# so commands to an instrument are serialized while many instruments run concurrently.
+#
+# #### Examples
+# `ps = AsyncPowerSupply()`
+#
+# `await ps.connect()`
+#
+# `await ps.set_voltage( 5 )`
+#
+# `await ps.source.volt.level()`
+#
+# ### Methods
+# **AsyncSCPIInstrument( inst )** Wraps an SCPI_Instrument
+#
+# **run( func, *args )** Runs a blocking function on the instrument's executor
+#
+# **close()** Shuts down the executor
+
+# In[1]:
+
+
+# standard imports
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import scpi_instrument as scpi
+import power_supply_controller as psc
+
+
+# In[2]:
+
+
+class AsyncProperty( object ):
+        """
+        Represents a scpi property of an async instrument
+
+        Calling it returns an awaitable.
+        """
+
+        __slots__ = ( '__inst', '__prop', '__dict__' )
+
+
+        def __init__( self, inst, prop ):
+            self.__inst = inst # the async instrument
+            self.__prop = prop # the synchronous Property
+
+
+        def __getattr__( self, name ):
+            prop = AsyncProperty( self.__inst, getattr( self.__prop, name ) )
+            self.__dict__[ name ] = prop # cache, subsequent lookups do not reach __getattr__
+            return prop
+
+
+        def __call__( self, value = None ):
+            return self.__inst.run( self.__prop, value )
+
+
+        @property
+        def name( self ):
+            return self.__prop.name
+
+
+# In[3]:
+
+
+class AsyncSCPIInstrument():
+    """
+    Represents an instrument, communicating through asyncio
+
+    Arbitrary SCPI commands can be performed
+    treating the hieracrchy of the command as attributes.
+
+    To read an property:  await inst.p1.p2.p3()
+    To call a function:   await inst.p1.p2( 'value' )
+    To execute a command: await inst.p1.p2.p3( '' )
+    """
+
+    #--- methods ---
+
+    def __getattr__( self, name ):
+        if name.startswith( '_' ):
+            # private attributes are not scpi commands
+            raise AttributeError( name )
+
+        prop = AsyncProperty( self, getattr( self.__inst, name ) )
+        self.__dict__[ name ] = prop # cache, subsequent lookups do not reach __getattr__
+        return prop
+
+
+    def __init__( self, inst ):
+        """
+        Creates an async client for an instrument
+
+        :param inst: The SCPI_Instrument to communicate through
+        """
+        self.__inst = inst
+        self.__executor = ThreadPoolExecutor( max_workers = 1 ) # serializes communication
+
+
+    async def __aenter__( self ):
+        await self.connect()
+        return self
+
+
+    async def __aexit__( self, *exc ):
+        await self.disconnect()
+        self.close()
+
+
+    #--- public methods ---
+
+    @property
+    def instrument( self ):
+        """
+        The synchronous instrument
+        """
+        return self.__inst
+
+
+    def run( self, func, *args ):
+        """
+        Runs a blocking function on the instrument's executor
+
+        :param func: The function to run
+        :param args: Arguments passed to the function
+        :returns: An awaitable of the function's result
+        """
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor( self.__executor, functools.partial( func, *args ) )
+
+
+    def close( self ):
+        """
+        Shuts down the executor, after pending commands finish
+        """
+        self.__executor.shutdown( wait = False )
+
+
+    async def connect( self ):
+        return await self.run( self.__inst.connect )
+
+
+    async def disconnect( self, close = False ):
+        return await self.run( self.__inst.disconnect, close )
+
+
+    async def write( self, msg ):
+        return await self.run( self.__inst.write, msg )
+
+
+    async def read( self ):
+        return await self.run( self.__inst.read )
+
+
+    async def query( self, msg ):
+        return await self.run( self.__inst.query, msg )
+
+
+    async def execute( self, commands ):
+        return await self.run( self.__inst.execute, commands )
+
+
+    async def query_values( self, msg = 'READ?', columns = None, dtype = float ):
+        return await self.run( self.__inst.query_values, msg, columns, dtype )
+
+
+    async def id( self ):
+        return await self.run( getattr, self.__inst, 'id' )
+
+
+    async def reset( self ):
+        return await self.run( self.__inst.reset )
+
+
+# In[4]:
+
+
+class AsyncPowerSupply( AsyncSCPIInstrument ):
+    """
+    A Tektronix PWS4305 power supply, communicating through asyncio
+    """
+
+    def __init__( self, inst = None, timeout = 10, rid = None ):
+        """
+        :param inst: The PowerSupply to communicate through.
+            If None one is created. [Default: None]
+        :param timeout: The communication timeout in seconds, if creating the PowerSupply [Default: 10]
+        :param rid: The resource id, if creating the PowerSupply [Default: None]
+        """
+        if inst is None:
+            inst = psc.PowerSupply( timeout, rid )
+
+        AsyncSCPIInstrument.__init__( self, inst )
+
+
+    #--- public methods ---
+
+    async def voltage( self ):
+        """
+        Returns the voltage setting
+        """
+        return await self.run( getattr, self.instrument, 'voltage' )
+
+
+    async def set_voltage( self, volts ):
+        """
+        Sets the voltage of the instrument
+        """
+        return await self.run( setattr, self.instrument, 'voltage', volts )
+
+
+    async def current( self ):
+        """
+        Returns the current setting in Amps
+        """
+        return await self.run( getattr, self.instrument, 'current' )
+
+
+    async def set_current( self, amps ):
+        """
+        Sets the current of the instrument
+        """
+        return await self.run( setattr, self.instrument, 'current', amps )
+
+
+    async def output_state( self ):
+        """
+        Returns if the output is on.
+        Not named output, which is the scpi property path, e.g. await ps.output.state()
+        """
+        return await self.run( self.instrument.output.state )
+
+
+    async def set_output_state( self, state ):
+        """
+        Turns the output on or off
+        """
+        if scpi.Property.val2bool( state ):
+            return await self.on()
+
+        return await self.off()
+
+
+    async def on( self ):
+        """
+        Turns the output on
+        """
+        return await self.run( self.instrument.on )
+
+
+    async def off( self ):
+        """
+        Turns the output off
+        """
+        return await self.run( self.instrument.off )
+
+
+    async def measure( self ):
+        """
+        Measures the output voltage and current
+
+        :returns: Tuple of ( volts, amps )
+        """
+        return await self.run( self.instrument.measure )
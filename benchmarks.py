@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Benchmarks
+# Timing of the hot paths of the SCPI stack, run against the simulated power supply
+#
+# Run with `python benchmarks.py [--latency <seconds>] [--number <calls>] [--output <file>]`
+#
+# Results are printed as JSON, with the time per call in seconds for each benchmark.
+#
+# `python benchmarks.py --check-imports` instead checks that importing the controller modules
+# stays within IMPORT_BUDGET and does not load heavy dependencies, exiting with an error if not.
+# The same check is enforced by test_imports.py, run with `python -m pytest`.
+
+# In[1]:
+
+
+# standard imports
+import os
+import sys
+import json
+import subprocess
+import time
+import argparse
+
+import numpy as np
+
+import scpi_instrument as scpi
+import power_supply_controller as psc
+import simulated_instrument as sim
+
+
+# In[2]:
+
+
+#--- static variables ---
+
+RID = 'USB0::0x0699::0x0392::BENCH::INSTR'
+PERCENTILES = ( 50, 90, 99 )
+
+IMPORT_MODULES = ( 'scpi_instrument', 'instrument_controller', 'power_supply_controller' )
+HEAVY_MODULES = ( 'visa', 'pyvisa', 'numpy', 'serial', 'aenum', 'usb', 'PyQt5' )
+IMPORT_BUDGET = 0.05 # seconds
+
+
+#--- payloads ---
+
+def read_response( readings = 100 ):
+    """
+    Creates a READ? response of ( current, voltage ) pairs,
+    in the format returned by the instrument
+
+    :param readings: Number of pairs in the response [Default: 100]
+    :returns: The response string
+    """
+    values = np.empty( 2* readings )
+    values[ 0::2 ] = 5e-14
+    values[ 1::2 ] = np.linspace( 0, 100, readings )
+
+    return ' ' + ','.join( '{:+.6E}'.format( val ) for val in values )
+
+
+def naive_parse( response ):
+    """
+    Parses a response by splitting and converting each value in Python
+    """
+    values = [ float( val ) for val in response.split( ',' ) ]
+    return list( zip( values[ 0::2 ], values[ 1::2 ] ) )
+
+
+#--- timing ---
+
+def measure( func, number = 1000, batch = 1 ):
+    """
+    Times calls of a function
+
+    :param func: The function to time, called with no arguments
+    :param number: Number of samples [Default: 1000]
+    :param batch: Number of calls per sample, for calls too fast to time individually [Default: 1]
+    :returns: Dictionary of statistics of the seconds per call
+    """
+    samples = np.empty( number )
+    for i in range( number ):
+        start = time.perf_counter()
+        for _ in range( batch ):
+            func()
+
+        samples[ i ] = ( time.perf_counter() - start ) / batch
+
+    stats = {
+        'calls': number* batch,
+        'mean':  samples.mean(),
+        'min':   samples.min(),
+        'max':   samples.max()
+    }
+
+    for percentile, value in zip( PERCENTILES, np.percentile( samples, PERCENTILES ) ):
+        stats[ 'p{}'.format( percentile ) ] = value
+
+    return { key: float( value ) for key, value in stats.items() }
+
+
+def bench_import( module ):
+    """
+    Times importing a module in a fresh interpreter
+
+    :param module: Name of the module
+    :returns: Dictionary of the import time in seconds,
+        and the heavy dependencies the import loaded
+    """
+    code = (
+        'import sys, time\n'
+        't = time.perf_counter()\n'
+        'import {module}\n'
+        'print( time.perf_counter() - t )\n'
+        'print( ",".join( m for m in {heavy} if m in sys.modules ) )\n'
+    ).format( module = module, heavy = HEAVY_MODULES )
+
+    out = subprocess.run(
+        [ sys.executable, '-c', code ],
+        cwd = os.path.dirname( os.path.abspath( __file__ ) ),
+        stdout = subprocess.PIPE,
+        universal_newlines = True,
+        check = True
+    ).stdout.splitlines()
+
+    return {
+        'seconds': float( out[ 0 ] ),
+        'loaded':  [ m for m in out[ 1 ].split( ',' ) if m ]
+    }
+
+
+def check_imports():
+    """
+    Checks the controller modules import within IMPORT_BUDGET without loading heavy dependencies
+
+    :returns: List of failure messages, empty if all pass
+    """
+    failures = []
+    for module in IMPORT_MODULES:
+        # best of several runs, to reduce noise
+        results = [ bench_import( module ) for _ in range( 3 ) ]
+        seconds = min( res[ 'seconds' ] for res in results )
+
+        if seconds > IMPORT_BUDGET:
+            failures.append( '{} took {:.1f} ms to import, budget is {:.1f} ms'.format(
+                module, 1e3* seconds, 1e3* IMPORT_BUDGET
+            ) )
+
+        if results[ 0 ][ 'loaded' ]:
+            failures.append( '{} loaded {}'.format( module, ', '.join( results[ 0 ][ 'loaded' ] ) ) )
+
+    return failures
+
+
+# In[3]:
+
+
+def run( latency = 0, number = 1000 ):
+    """
+    Runs the benchmark suite
+
+    :param latency: Latency of each transfer of the simulated instrument in seconds [Default: 0]
+    :param number: Number of samples of each benchmark [Default: 1000]
+    :returns: Dictionary of benchmark name to statistics
+    """
+    device = sim.manager.add( RID, latency = latency )
+    ps = psc.PowerSupply( rid = RID, backend = sim.BACKEND )
+    ps.connect()
+
+    results = {}
+
+    #--- imports ---
+    for module in IMPORT_MODULES:
+        results[ 'import_{}'.format( module ) ] = bench_import( module )
+
+    #--- property resolution ---
+    results[ 'property_path' ] = measure( lambda: ps.source.volt.level, number, batch = 100 )
+
+    #--- round trips ---
+    results[ 'write' ] = measure( lambda: ps.write( 'SOUR:VOLT 1' ), number )
+    results[ 'query' ] = measure( lambda: ps.query( 'SOUR:VOLT?' ), number )
+
+    #--- setpoints ---
+    volts = iter( np.tile( np.linspace( 0, 30, 301 ), number // 301 + 1 ) )
+    results[ 'set_voltage' ] = measure( lambda: setattr( ps, 'voltage', next( volts ) ), number )
+
+    def sequential():
+        ps.voltage = 5
+        ps.current = 1
+        ps.on()
+
+    def batched():
+        with ps.batch():
+            sequential()
+
+    results[ 'setpoints_sequential' ] = measure( sequential, number )
+    results[ 'setpoints_batched' ] = measure( batched, number )
+
+    #--- connection ---
+    ps.disconnect()
+
+    def connect_disconnect():
+        inst = psc.PowerSupply( rid = RID, backend = sim.BACKEND )
+        inst.connect()
+        inst.disconnect()
+
+    results[ 'connect_disconnect' ] = measure( connect_disconnect, number )
+
+    #--- parsing ---
+    for readings in ( 100, 10000 ):
+        response = read_response( readings )
+        results[ 'parse_naive_{}'.format( readings ) ] = measure( lambda: naive_parse( response ), number // 10 + 1 )
+        results[ 'parse_values_{}'.format( readings ) ] = measure(
+            lambda: scpi.SCPI_Instrument.parse_values( response, 2 ), number // 10 + 1
+        )
+
+    return results
+
+
+# # CLI
+
+# In[4]:
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description = 'Benchmarks of the SCPI stack' )
+    parser.add_argument( '--latency', type = float, default = 0, help = 'Simulated transfer latency in seconds [Default: 0]' )
+    parser.add_argument( '--number', type = int, default = 1000, help = 'Samples per benchmark [Default: 1000]' )
+    parser.add_argument( '--output', help = 'File to write the results to [Default: stdout]' )
+    parser.add_argument( '--check-imports', action = 'store_true', help = 'Check import time and dependencies, then exit' )
+    args = parser.parse_args()
+
+    if args.check_imports:
+        failures = check_imports()
+        for failure in failures:
+            print( failure )
+
+        sys.exit( 1 if failures else 0 )
+
+    results = {
+        'latency': args.latency,
+        'number':  args.number,
+        'python':  sys.version.split()[ 0 ],
+        'results': run( args.latency, args.number )
+    }
+
+    if args.output is None:
+        print( json.dumps( results, indent = 2 ) )
+
+    else:
+        with open( args.output, 'w' ) as f:
+            json.dump( results, f, indent = 2 )
@@ -10,10 +10,10 @@
 # standard imports
 import os
 import sys
-
-# SCPI imports
-import usb
-import visa
+import math
+import time
+import threading
+from enum import Enum
 
 # instrument controller
 import instrument_controller as ic
@@ -22,20 +22,119 @@ import instrument_controller as ic
 # In[2]:
 
 
+class FunctionMode( Enum ):
+    """
+    Source function of the power supply
+    """
+    FIXED = 'FIX'
+    LIST  = 'LIST'
+    
+    
+class StepMode( Enum ):
+    """
+    Stepping of a running list
+    """
+    AUTO = 'AUTO'
+    ONCE = 'ONCE'
+    
+    
+class TriggerSource( Enum ):
+    """
+    Source of the trigger starting a list
+    """
+    IMMEDIATE = 'IMM'
+    BUS       = 'BUS'
+    EXTERNAL  = 'EXT'
+    
+    
 class PowerSupply( ic.Instrument ):
+    """
+    A Tektronix PWS4305 power supply
+    
+    Commands of the PWS4305 are declared in the COMMANDS schema, becoming methods
+    validating values before they are sent, e.g. ps.voltage_level( 5 ).
+    Queries of declared commands return typed values, e.g. ps.output.state() returns a bool.
+    Other commands can be sent through the dynamic property paths, unchecked.
+    
+    Setpoints and output state can optionally be cached,
+    skipping redundant writes and serving getters without querying.
+    Changes made through the dynamic property paths, e.g. ps.source.volt.level( 5 ),
+    are not tracked, call invalidate() after using them.
+    """
+    
+    #--- static variables ---
+    DEFAULT_RID = 'USB0::0x0699::0x0392::C011451::INSTR' # the lab supply, see power_supply_discovery for others
+    INVALIDATING_COMMANDS = ( '*RST', '*RCL' ) # commands changing the state of the instrument
+    MAX_VOLTAGE = 30 # V
+    MAX_CURRENT = 5 # A
+    MAX_DWELL = 60 # s, of a list step
+    MAX_SEQUENCE_STEPS = 80 # steps of the list memory
+    SEQUENCE_SLOTS = 7 # lists saved in the instrument
     
-    def __init__( self, timeout = 10, rid = None ):
-        ic.Instrument.__init__( self, None, timeout, '\n', '\n' )
-        self.rid = 'USB0::0x0699::0x0392::C011451::INSTR' if ( rid is None ) else rid
+    COMMANDS = {
+        'voltage_level':          ic.Command( '[SOUR:]VOLT[:LEV][:IMM][:AMPL]', float, 0, MAX_VOLTAGE, 'V' ),
+        'current_level':          ic.Command( '[SOUR:]CURR[:LEV][:IMM][:AMPL]', float, 0, MAX_CURRENT, 'A' ),
+        'output_state':           ic.Command( 'OUTP[:STAT]', bool ),
+        'measured_voltage':       ic.Command( 'MEAS[:SCAL]:VOLT[:DC]', float, units = 'V', write = False ),
+        'measured_current':       ic.Command( 'MEAS[:SCAL]:CURR[:DC]', float, units = 'A', write = False ),
+        'function_mode':          ic.Command( '[SOUR:]FUNC:MODE', FunctionMode ),
+        'list_voltage':           ic.Command( '[SOUR:]LIST:VOLT[:LEV]', float, 0, MAX_VOLTAGE, 'V', sequence = True ),
+        'list_current':           ic.Command( '[SOUR:]LIST:CURR[:LEV]', float, 0, MAX_CURRENT, 'A', sequence = True ),
+        'list_width':             ic.Command( '[SOUR:]LIST:WIDT', float, 0, MAX_DWELL, 's', sequence = True ),
+        'list_count':             ic.Command( '[SOUR:]LIST:COUN', int, 1 ),
+        'list_step':              ic.Command( '[SOUR:]LIST:STEP', StepMode ),
+        'list_save':              ic.Command( '[SOUR:]LIST:SAV', int, 1, SEQUENCE_SLOTS, query = False ),
+        'list_recall':            ic.Command( '[SOUR:]LIST:RCL', int, 1, SEQUENCE_SLOTS, query = False ),
+        'trigger_source':         ic.Command( 'TRIG[:SEQ]:SOUR', TriggerSource ),
+        'initiate':               ic.Command( 'INIT[:IMM]', None ),
+        'abort':                  ic.Command( 'ABOR', None ),
+        'system_error':           ic.Command( 'SYST:ERR[:NEXT]', ic.scpi.parse_error, write = False ),
+        'system_local':           ic.Command( 'SYST:LOC', None ),
+        'system_remote':          ic.Command( 'SYST:REM', None ),
+        'system_version':         ic.Command( 'SYST:VERS', str, write = False ),
+        'questionable_condition': ic.Command( 'STAT:QUES:COND', int, write = False ),
+        'operation_condition':    ic.Command( 'STAT:OPER:COND', int, write = False )
+    }
+    
+    # probed once per session, see capabilities
+    CAPABILITIES = {
+        'scpi_version': 'SYST:VERS?',
+        'voltage_min':  'VOLT? MIN',
+        'voltage_max':  'VOLT? MAX',
+        'current_min':  'CURR? MIN',
+        'current_max':  'CURR? MAX',
+        'list':         'LIST:COUN?',
+        'trigger':      'TRIG:SOUR?'
+    }
+    
+    
+    def __init__( self, timeout = 10, rid = None, cache = None, backend = '' ):
+        """
+        :param timeout: The communication timeout in seconds [Default: 10]
+        :param rid: The resource id [Default: None, DEFAULT_RID]
+        :param cache: Time in seconds cached setpoints are valid for,
+            float( 'inf' ) to never expire. If None setpoints are not cached. [Default: None]
+        :param backend: The pyvisa backend to use for communication [Default: '']
+        """
+        self.cache = cache
+        self.__state = {} # cached state, name -> ( value, time )
+        self.__sequence = None # sequence in the list memory
+        self.__sequence_slots = {} # saved sequences, slot -> sequence
+        
+        ic.Instrument.__init__( self, None, timeout, '\n', '\n', backend )
+        self.rid = self.DEFAULT_RID if ( rid is None ) else rid
         
     #--- public methods ---
     
     @property        
     def voltage( self ):
         """
-        Returns the voltage setting
+        Returns the voltage setting as a float
         """
-        return self.source.volt.level()
+        if self.cache is None:
+            return self.voltage_level()
+        
+        return self.__get_cached( 'voltage', self.voltage_level )
     
     
     @voltage.setter
@@ -43,15 +142,22 @@ class PowerSupply( ic.Instrument ):
         """
         Sets the voltage of the instrument
         """
-        self.source.volt.level( volts )
+        if self.cache is None:
+            self.voltage_level( volts )
+            return
+        
+        self.__set_cached( 'voltage', volts, self.voltage_level, float )
         
     
     @property
     def current( self ):
         """
-        Returns the current setting in Amps
+        Returns the current setting in Amps as a float
         """
-        return self.source.current.level()
+        if self.cache is None:
+            return self.current_level()
+        
+        return self.__get_cached( 'current', self.current_level )
         
         
     @current.setter
@@ -59,45 +165,964 @@ class PowerSupply( ic.Instrument ):
         """
         Set the current of the instrument
         """
-        self.source.current.level( amps )
+        if self.cache is None:
+            self.current_level( amps )
+            return
+        
+        self.__set_cached( 'current', amps, self.current_level, float )
         
     
     def on( self ):
         """
         Turns the output on
         """
-        self.output.state( 'on' )
+        if self.cache is None:
+            self.output_state( True )
+            return
+        
+        self.__set_cached( 'output', True, self.output_state )
         
         
     def off( self):
         """
         Turns the output off
         """
-        self.output.state( 'off' )
+        if self.cache is None:
+            self.output_state( False )
+            return
+        
+        self.__set_cached( 'output', False, self.output_state )
+        
+        
+    def invalidate( self, sequence = True ):
+        """
+        Clears the cached state
+        
+        :param sequence: Also forget the sequence in the list memory [Default: True]
+        """
+        self.__state.clear()
+        if sequence:
+            self.__sequence = None
+        
+        
+    def write( self, msg ):
+        self.__check_invalidating( [ msg ] )
+        return ic.Instrument.write( self, msg )
+    
+    
+    def execute( self, commands ):
+        self.__check_invalidating( commands )
+        try:
+            return ic.Instrument.execute( self, commands )
+        
+        except:
+            # batched writes may have been cached, the list memory only by list commands
+            self.invalidate( sequence = any( 'LIST:' in cmd.upper() for cmd in commands ) )
+            raise
+            
+            
+    def reset( self ):
+        """
+        Resets the instrument to its initial state
+        """
+        self.invalidate()
+        return ic.Instrument.reset( self )
+        
+        
+    def disconnect( self, close = False ):
+        self.invalidate()
+        return ic.Instrument.disconnect( self, close )
+        
+        
+    def measure( self ):
+        """
+        Measures the output voltage and current in a single message
+        
+        :returns: Tuple of ( volts, amps )
+        """
+        volts, amps = self.execute( [ 'MEAS:VOLT?', 'MEAS:CURR?' ] )
+        return ( self.decode( 'MEAS:VOLT?', volts ), self.decode( 'MEAS:CURR?', amps ) )
+    
+    
+    def snapshot( self ):
+        """
+        Reads the setpoints, output state and measured output in a single message
+        
+        :returns: Dictionary with keys voltage, current, output, measured_voltage and measured_current
+        """
+        queries = [ 'SOUR:VOLT?', 'SOUR:CURR?', 'OUTP?', 'MEAS:VOLT?', 'MEAS:CURR?' ]
+        volts, amps, output, measured_volts, measured_amps = (
+            self.decode( msg, response )
+            for msg, response in zip( queries, self.execute( queries ) )
+        )
+        
+        return {
+            'voltage':          volts,
+            'current':          amps,
+            'output':           output,
+            'measured_voltage': measured_volts,
+            'measured_current': measured_amps
+        }
+    
+    
+    def wait_settled(
+        self,
+        voltage = None,
+        current = None,
+        voltage_tolerance = 0.01,
+        current_tolerance = 0.001,
+        timeout = 10,
+        min_interval = 0.005,
+        max_interval = 0.5
+    ):
+        """
+        Waits for pending operations to complete and the output to settle,
+        instead of sleeping a worst case time
+        
+        The instrument is synchronized with *OPC?, then the output is measured until
+        the last three measurements are within the tolerances of each other,
+        the change still to come, extrapolated assuming exponential settling, is within the tolerances,
+        and the output is within the tolerances of the targets, if given.
+        Measurements are timed by the extrapolated settling time,
+        backing off while the output does not settle exponentially.
+        
+        :param voltage: Target voltage, None to only wait for the voltage to stop changing [Default: None]
+        :param current: Target current, None to only wait for the current to stop changing [Default: None]
+        :param voltage_tolerance: Voltage tolerance in Volts [Default: 0.01]
+        :param current_tolerance: Current tolerance in Amps [Default: 0.001]
+        :param timeout: Maximum seconds to wait [Default: 10]
+        :param min_interval: Minimum seconds between measurements [Default: 0.005]
+        :param max_interval: Maximum seconds between measurements [Default: 0.5]
+        :returns: Tuple of the settled ( volts, amps )
+        """
+        deadline = time.monotonic() + timeout
+        self.query( '*OPC?' )
+        
+        targets = ( voltage, current )
+        tolerances = ( voltage_tolerance, current_tolerance )
+        
+        samples = [] # ( time, volts, amps ) of the last three measurements
+        interval = min_interval
+        while True:
+            samples = samples[ -2: ] + [ ( time.monotonic(), ) + self.measure() ]
+            
+            settled = True
+            wait = 0 # seconds the output is expected to need to settle, inf if unknown
+            for channel in ( 1, 2 ):
+                ( channel_settled, channel_wait ) = self.__settling(
+                    samples, channel, targets[ channel - 1 ], tolerances[ channel - 1 ]
+                )
+                
+                settled = settled and channel_settled
+                wait = max( wait, channel_wait )
+                
+            if settled:
+                return samples[ -1 ][ 1: ]
+            
+            now = time.monotonic()
+            if now >= deadline:
+                raise Exception( 'Can not settle, output did not settle within {} s'.format( timeout ) )
+            
+            # adapt polling to the expected settling time, backing off if unknown
+            interval = min( interval* 2, max_interval ) if math.isinf( wait ) else min( max( wait, min_interval ), max_interval )
+            time.sleep( min( interval, deadline - now ) )
+            
+            
+    def upload_sequence( self, voltages, currents, dwell, count = 1, slot = None ):
+        """
+        Uploads a sequence of steps to the list memory in a single message
+        
+        The upload is skipped if the sequence is already in the list memory,
+        and recalled instead of transferred if it was saved in a slot.
+        
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, or a single current for all
+        :param dwell: List of seconds each step lasts, or a single duration for all
+        :param count: Number of times the sequence runs [Default: 1]
+        :param slot: Slot to save the sequence in, 1 to SEQUENCE_SLOTS. If None it is not saved. [Default: None]
+        :returns: True if the sequence was transferred, False if it was cached
+        """
+        sequence = self.__format_sequence( voltages, currents, dwell, count )
+        
+        if sequence == self.__sequence:
+            return False
+        
+        if not self.supports( 'list' ):
+            raise Exception( 'Can not upload sequence, list mode is not supported' )
+        
+        commands = []
+        saved = [ key for key, value in self.__sequence_slots.items() if value == sequence ]
+        if saved:
+            commands.append( self.COMMANDS[ 'list_recall' ].message( saved[ 0 ] ) )
+            
+        else:
+            commands += [
+                self.COMMANDS[ name ].write_prefix + value
+                for name, value in zip( ( 'list_voltage', 'list_current', 'list_width', 'list_count' ), sequence )
+            ]
+        
+        if ( slot is not None ) and ( self.__sequence_slots.get( slot ) != sequence ):
+            commands.append( self.COMMANDS[ 'list_save' ].message( slot ) )
+            
+        try:
+            self.execute( commands )
+            
+        except:
+            self.__sequence = None
+            if slot is not None:
+                # slot may have been partially saved
+                self.__sequence_slots.pop( slot, None )
+                
+            raise
+            
+        self.__sequence = sequence
+        if slot is not None:
+            self.__sequence_slots[ slot ] = sequence
+            
+        return not saved
+    
+    
+    def sequence( self, voltages, currents, dwell, count = 1, slot = None ):
+        """
+        Creates a sequence run by the instrument from its list memory
+        
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, or a single current for all
+        :param dwell: List of seconds each step lasts, or a single duration for all
+        :param count: Number of times the sequence runs [Default: 1]
+        :param slot: Slot to save the sequence in. If None it is not saved. [Default: None]
+        :returns: A Sequence, call start() to upload and run it
+        """
+        return Sequence( self, voltages, currents, dwell, count, slot )
+    
+    
+    def schedule( self, voltages, currents = None, dwell = 1, output = False ):
+        """
+        Creates a sequence of setpoint steps timed by the host,
+        for when the sequence can not run on the instrument
+        
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, a single current for all,
+            or None to leave the current unchanged [Default: None]
+        :param dwell: List of seconds each step lasts, or a single duration for all [Default: 1]
+        :param output: Turn the output on with the first step [Default: False]
+        :returns: A Schedule, call start() or run() to run it
+        """
+        return Schedule( self, voltages, currents, dwell, output )
+    
+    
+    def program( self, voltages, currents = None, dwell = 1 ):
+        """
+        Creates a sequence of setpoint steps, run by the instrument if it supports list mode
+        and the steps fit in the list memory, otherwise timed by the host
+        
+        Either way start() turns the output on with the first step,
+        and wait() returns once the last step's dwell ends, leaving the output at the last step.
+        A Sequence keeps the instrument in list mode until stop().
+        
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, a single current for all,
+            or None to leave the current unchanged [Default: None]
+        :param dwell: List of seconds each step lasts, or a single duration for all [Default: 1]
+        :returns: A Sequence or Schedule, call start() to run it
+        """
+        if self.supports( 'list' ):
+            list_currents = self.current if ( currents is None ) else currents
+            try:
+                self.__format_sequence( voltages, list_currents, dwell, 1 )
+                
+            except Exception:
+                pass
+            
+            else:
+                return self.sequence( voltages, list_currents, dwell )
+            
+        return self.schedule( voltages, currents, dwell, output = True )
+    
+    
+    def telemetry( self, rate = 10, capacity = 36000 ):
+        """
+        Creates a telemetry acquisition for the power supply
+        
+        :param rate: Samples per second [Default: 10]
+        :param capacity: Number of samples kept [Default: 36000, 1 hour at 10 Hz]
+        :returns: A Telemetry, call start() to begin acquiring
+        """
+        return Telemetry( self, rate, capacity )
+    
+    
+    #--- private methods ---
+    
+    def __check_invalidating( self, commands ):
+        """
+        Clears the cached state if any of the commands changes the state of the instrument
+        """
+        if ( self.cache is None ) and ( self.__sequence is None ):
+            return
+        
+        for cmd in commands:
+            if cmd.lstrip( ':' ).upper().startswith( self.INVALIDATING_COMMANDS ):
+                self.invalidate()
+                return
+            
+            
+    @staticmethod
+    def __settling( samples, channel, target, tolerance ):
+        """
+        Checks if a channel of the output is settled
+        
+        :param samples: List of the last ( time, volts, amps ) measurements
+        :param channel: Index of the channel in the samples, 1 for volts, 2 for amps
+        :param target: Target value, or None
+        :param tolerance: Tolerance of the value
+        :returns: Tuple of ( settled, wait ) with wait the estimated seconds to settle, inf if unknown
+        """
+        values = [ sample[ channel ] for sample in samples ]
+        if len( values ) < 3:
+            return ( False, math.inf )
+        
+        settled = (
+            ( max( values ) - min( values ) <= tolerance ) and
+            ( ( target is None ) or ( abs( values[ -1 ] - target ) <= tolerance ) )
+        )
+        
+        # rates of change between the measurements
+        ( t0, t1, t2 ) = ( sample[ 0 ] for sample in samples )
+        rate_1 = ( values[ 1 ] - values[ 0 ] ) / ( t1 - t0 )
+        rate_2 = ( values[ 2 ] - values[ 1 ] ) / ( t2 - t1 )
+        
+        if ( rate_1 == 0 ) or not ( 0 < rate_2 / rate_1 < 1 ):
+            # not settling exponentially, e.g. settled within noise
+            return ( settled, 0 if settled else math.inf )
+        
+        # time constant of exponential settling, and the change still to come
+        tau = ( t2 - t0 ) / 2 / math.log( rate_1 / rate_2 )
+        remaining = abs( rate_2 )* tau
+        if remaining <= tolerance:
+            return ( settled, 0 )
+        
+        return ( False, tau* math.log( remaining / tolerance ) )
+    
+    
+    def __format_sequence( self, voltages, currents, dwell, count ):
+        """
+        Validates a sequence, formatting it as sent to the instrument
+        
+        :returns: Tuple of ( voltages, currents, widths, count ) strings
+        """
+        steps = len( voltages )
+        if not ( 1 <= steps <= self.MAX_SEQUENCE_STEPS ):
+            raise Exception( 'Can not upload sequence, must have between 1 and {} steps'.format( self.MAX_SEQUENCE_STEPS ) )
+        
+        columns = []
+        for name, values in ( ( 'list_voltage', voltages ), ( 'list_current', currents ), ( 'list_width', dwell ) ):
+            if not hasattr( values, '__len__' ):
+                values = [ values ]* steps
+            
+            if len( values ) != steps:
+                raise Exception( 'Can not upload sequence, voltages, currents and dwell must have the same length' )
+            
+            # validates ranges
+            columns.append( self.COMMANDS[ name ].encode( [ float( '{:.6g}'.format( val ) ) for val in values ] ) )
+            
+        if min( float( val ) for val in columns[ 2 ].split( ',' ) ) <= 0:
+            raise Exception( 'Can not upload sequence, dwell must be positive' )
+            
+        return tuple( columns ) + ( self.COMMANDS[ 'list_count' ].encode( count ), )
+        
+        
+    def __get_cached( self, name, query ):
+        """
+        Returns the cached value if still valid, otherwise queries it
+        
+        :param name: Name of the cached value
+        :param query: Function returning the value from the instrument
+        """
+        if self.batching:
+            # queued, the response is placed in the batch's results
+            return query()
+        
+        entry = self.__state.get( name )
+        if ( entry is not None ) and ( time.monotonic() - entry[ 1 ] < self.cache ):
+            return entry[ 0 ]
+        
+        try:
+            value = float( query() )
+            
+        except:
+            self.invalidate()
+            raise
+            
+        self.__state[ name ] = ( value, time.monotonic() )
+        return value
+    
+    
+    def __set_cached( self, name, value, write, convert = None ):
+        """
+        Writes the value unless it matches the valid cached value
+        
+        :param name: Name of the cached value
+        :param value: The value to set
+        :param write: Function writing the value to the instrument
+        :param convert: Function converting the value as cached, raising ValueError
+            for values the instrument resolves, e.g. MIN or MAX, which are written uncached [Default: None]
+        """
+        if convert is not None:
+            try:
+                value = convert( value )
+                
+            except ( TypeError, ValueError ):
+                # resulting setting is not known
+                self.__state.pop( name, None )
+                write( value )
+                return
+            
+        entry = self.__state.get( name )
+        if (
+            ( entry is not None ) and
+            ( entry[ 0 ] == value ) and
+            ( time.monotonic() - entry[ 1 ] < self.cache )
+        ):
+            return
+        
+        try:
+            write( value )
+            
+        except:
+            self.invalidate()
+            raise
+            
+        self.__state[ name ] = ( value, time.monotonic() )
         
 
 
 # In[3]:
 
 
-# ps = PowerSupply()
+class Telemetry( object ):
+    """
+    Continuously measures the output of a power supply on a background thread
+    
+    Samples of ( time, volts, amps ) are stored in a fixed size ring buffer,
+    with time from time.monotonic().
+    Each sample is written twice, capacity apart, so the latest samples
+    are always contiguous and can be read as a view without copying.
+    """
+    
+    #--- static variables ---
+    TIME    = 0
+    VOLTAGE = 1
+    CURRENT = 2
+    
+    
+    def __init__( self, inst, rate = 10, capacity = 36000 ):
+        """
+        :param inst: The PowerSupply to measure
+        :param rate: Samples per second [Default: 10]
+        :param capacity: Number of samples kept [Default: 36000]
+        """
+        self.inst = inst
+        self.rate = rate
+        self.capacity = capacity
+        
+        import numpy as np
+        
+        #--- private instance variables ---
+        self.__buffer = np.full( ( 2* capacity, 3 ), np.nan )
+        self.__count = 0 # total samples acquired
+        self.__thread = None
+        self.__stop = threading.Event()
+        
+        
+    #--- public methods ---
+    
+    @property
+    def running( self ):
+        """
+        Returns if acquisition is running
+        """
+        return ( self.__thread is not None ) and self.__thread.is_alive()
+    
+    
+    @property
+    def count( self ):
+        """
+        Returns the total number of samples acquired
+        """
+        return self.__count
+    
+    
+    @property
+    def latest( self ):
+        """
+        Returns the latest sample, or None if none have been acquired
+        """
+        window = self.window( 1 )
+        return window[ 0 ] if len( window ) else None
+    
+    
+    def window( self, samples = None ):
+        """
+        Returns the latest samples as a view into the ring buffer
+        
+        The view is overwritten once more than capacity new samples are acquired,
+        copy it to keep it longer.
+        
+        :param samples: Number of samples, at most capacity. [Default: None, all available]
+        :returns: A numpy array of shape ( samples, 3 ) with columns time, volts, amps
+        """
+        count = self.__count
+        available = min( count, self.capacity )
+        samples = available if ( samples is None ) else min( samples, available )
+        
+        end = count % self.capacity + self.capacity
+        return self.__buffer[ end - samples : end ]
+    
+    
+    def start( self ):
+        """
+        Starts acquiring samples
+        """
+        if self.running:
+            return
+        
+        self.__stop.clear()
+        self.__thread = threading.Thread( target = self.__acquire, daemon = True )
+        self.__thread.start()
+        
+        
+    def stop( self ):
+        """
+        Stops acquiring samples, waiting for the current measurement to finish
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+            
+            
+    #--- private methods ---
+    
+    def __acquire( self ):
+        period = 1 / self.rate
+        deadline = time.monotonic()
+        
+        while not self.__stop.is_set():
+            try:
+                volts, amps = self.inst.measure()
+                
+            except Exception:
+                # skip failed sample
+                pass
+                
+            else:
+                self.__record( time.monotonic(), volts, amps )
+            
+            # wait for next deadline, skipping missed ones
+            deadline += period
+            now = time.monotonic()
+            if deadline < now:
+                deadline += period* ( ( now - deadline ) // period + 1 )
+                
+            self.__stop.wait( deadline - now )
+            
+            
+    def __record( self, timestamp, volts, amps ):
+        index = self.__count % self.capacity
+        sample = ( timestamp, volts, amps )
+        
+        self.__buffer[ index ] = sample
+        self.__buffer[ index + self.capacity ] = sample
+        self.__count += 1
+        
 
 
 # In[4]:
 
 
-# ps.connect()
+class Sequence( object ):
+    """
+    A sequence of voltage and current steps run by the power supply from its list memory
+    
+    Step timing is kept by the instrument, independent of the host and bus.
+    Progress is estimated on the host from the dwell times, as the instrument
+    does not report its current step.
+    """
+    
+    def __init__( self, inst, voltages, currents, dwell, count = 1, slot = None ):
+        """
+        :param inst: The PowerSupply to run the sequence on
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, or a single current for all
+        :param dwell: List of seconds each step lasts, or a single duration for all
+        :param count: Number of times the sequence runs [Default: 1]
+        :param slot: Slot to save the sequence in. If None it is not saved. [Default: None]
+        """
+        self.inst = inst
+        self.voltages = voltages
+        self.currents = currents
+        self.dwell = dwell if hasattr( dwell, '__len__' ) else [ dwell ]* len( voltages )
+        self.count = count
+        self.slot = slot
+        
+        #--- private instance variables ---
+        self.__started = None # time the sequence started, shifted by time paused
+        self.__paused = None # time the sequence was paused
+        
+        
+    #--- public methods ---
+    
+    @property
+    def duration( self ):
+        """
+        Returns the duration of the sequence in seconds, including repetitions
+        """
+        return sum( self.dwell )* self.count
+    
+    
+    @property
+    def elapsed( self ):
+        """
+        Returns the seconds the sequence has run, excluding pauses, or None if not started
+        """
+        if self.__started is None:
+            return None
+        
+        now = time.monotonic() if ( self.__paused is None ) else self.__paused
+        return min( now - self.__started, self.duration )
+    
+    
+    @property
+    def running( self ):
+        """
+        Returns if the sequence is running and not paused
+        """
+        return (
+            ( self.__started is not None ) and
+            ( self.__paused is None ) and
+            ( self.elapsed < self.duration )
+        )
+    
+    
+    @property
+    def paused( self ):
+        """
+        Returns if the sequence is paused
+        """
+        return self.__paused is not None
+    
+    
+    @property
+    def step( self ):
+        """
+        Returns the estimated index of the current step, or None if not started
+        """
+        elapsed = self.elapsed
+        if elapsed is None:
+            return None
+        
+        if elapsed >= self.duration:
+            return len( self.dwell ) - 1
+        
+        elapsed %= sum( self.dwell )
+        for index, width in enumerate( self.dwell ):
+            elapsed -= width
+            if elapsed < 0:
+                return index
+            
+        return len( self.dwell ) - 1
+    
+    
+    def upload( self ):
+        """
+        Uploads the sequence, skipped if cached
+        
+        :returns: True if the sequence was transferred, False if it was cached
+        """
+        return self.inst.upload_sequence( self.voltages, self.currents, self.dwell, self.count, self.slot )
+    
+    
+    def start( self ):
+        """
+        Uploads the sequence if needed, then starts it with the output on
+        """
+        self.upload()
+        self.inst.execute( [ 'FUNC:MODE LIST', 'LIST:STEP AUTO', 'TRIG:SOUR IMM', 'OUTP ON', 'INIT' ] )
+        self.inst.invalidate( sequence = False ) # setpoints are changed by the sequence
+        
+        self.__started = time.monotonic()
+        self.__paused = None
+        
+        
+    def pause( self ):
+        """
+        Pauses the sequence at its current step
+        """
+        if ( self.__started is None ) or ( self.__paused is not None ):
+            return
+        
+        self.inst.write( 'LIST:STEP ONCE' )
+        self.__paused = time.monotonic()
+        
+        
+    def resume( self ):
+        """
+        Resumes a paused sequence
+        """
+        if self.__paused is None:
+            return
+        
+        self.inst.execute( [ 'LIST:STEP AUTO', '*TRG' ] )
+        self.__started += time.monotonic() - self.__paused
+        self.__paused = None
+        
+        
+    def stop( self ):
+        """
+        Stops the sequence, returning the instrument to fixed mode
+        """
+        self.inst.execute( [ 'ABOR', 'FUNC:MODE FIX' ] )
+        self.inst.invalidate( sequence = False ) # setpoints were changed by the sequence
+        
+        self.__started = None
+        self.__paused = None
+        
+        
+    def status( self ):
+        """
+        Measures the output and estimates the progress of the sequence
+        
+        :returns: Dictionary with keys running, paused, step, repetition, elapsed, voltage and current
+        """
+        volts, amps = self.inst.measure()
+        elapsed = self.elapsed
+        
+        return {
+            'running':    self.running,
+            'paused':     self.paused,
+            'step':       self.step,
+            'repetition': None if ( elapsed is None ) else min( int( elapsed // sum( self.dwell ) ), self.count - 1 ),
+            'elapsed':    elapsed,
+            'voltage':    volts,
+            'current':    amps
+        }
+    
+    
+    def wait( self, interval = 0.1 ):
+        """
+        Waits for the sequence to finish
+        
+        :param interval: Seconds between checks [Default: 0.1]
+        """
+        while self.running:
+            time.sleep( min( interval, self.duration - self.elapsed ) )
+        
 
 
 # In[5]:
 
 
-# ps.id
+class Schedule( object ):
+    """
+    Runs a sequence of setpoint steps from the host against absolute deadlines
+    
+    Step deadlines are fixed from the start time, so latency of one step
+    does not delay the following ones. Each step is sent early by the
+    estimated command latency so it completes at its deadline,
+    and the lateness of each step is recorded.
+    """
+    
+    #--- static variables ---
+    SPIN = 0.002 # seconds before a deadline to stop sleeping and busy wait
+    LATENCY_WEIGHT = 0.2 # weight of each new measurement in the latency estimate
+    
+    
+    def __init__( self, inst, voltages, currents = None, dwell = 1, output = False ):
+        """
+        :param inst: The PowerSupply to run the steps on
+        :param voltages: List of voltages of the steps
+        :param currents: List of currents of the steps, a single current for all,
+            or None to leave the current unchanged [Default: None]
+        :param dwell: List of seconds each step lasts, or a single duration for all [Default: 1]
+        :param output: Turn the output on with the first step, as a Sequence does [Default: False]
+        """
+        steps = len( voltages )
+        if ( currents is not None ) and not hasattr( currents, '__len__' ):
+            currents = [ currents ]* steps
+            
+        if not hasattr( dwell, '__len__' ):
+            dwell = [ dwell ]* steps
+            
+        if ( len( dwell ) != steps ) or ( ( currents is not None ) and ( len( currents ) != steps ) ):
+            raise Exception( 'Can not create schedule, voltages, currents and dwell must have the same length' )
+        
+        self.inst = inst
+        self.voltages = voltages
+        self.currents = currents
+        self.dwell = dwell
+        self.output = output
+        self.latency = 0 # estimated seconds for a step to be sent
+        
+        #--- private instance variables ---
+        self.__lateness = [] # seconds each step completed after its deadline
+        self.__thread = None
+        self.__stop = threading.Event()
+        
+        
+    #--- public methods ---
+    
+    @property
+    def running( self ):
+        """
+        Returns if the schedule is running in the background
+        """
+        return ( self.__thread is not None ) and self.__thread.is_alive()
+    
+    
+    @property
+    def lateness( self ):
+        """
+        Returns the seconds each completed step finished after its deadline,
+        negative if early
+        """
+        return list( self.__lateness )
+    
+    
+    def run( self, delay = 0 ):
+        """
+        Runs the steps, blocking until the last step's dwell ends or stopped
+        
+        :param delay: Seconds from now to the deadline of the first step [Default: 0]
+        :returns: Dictionary of lateness statistics, see statistics()
+        """
+        self.__stop.clear()
+        self.__lateness = []
+        
+        deadline = time.monotonic() + delay
+        for index, volts in enumerate( self.voltages ):
+            # send early by the expected latency, so the step completes at its deadline
+            if self.__wait( deadline - self.latency ):
+                break
+            
+            start = time.monotonic()
+            with self.inst.batch():
+                self.inst.voltage = volts
+                if self.currents is not None:
+                    self.inst.current = self.currents[ index ]
+                    
+                if self.output and ( index == 0 ):
+                    self.inst.on()
+                    
+            end = time.monotonic()
+            
+            self.__lateness.append( end - deadline )
+            self.latency += self.LATENCY_WEIGHT* ( end - start - self.latency )
+            
+            deadline += self.dwell[ index ]
+            
+        else:
+            # hold the last step for its dwell
+            self.__wait( deadline )
+            
+        return self.statistics()
+    
+    
+    def start( self, delay = 0 ):
+        """
+        Runs the steps on a background thread
+        
+        :param delay: Seconds from now to the deadline of the first step [Default: 0]
+        """
+        if self.running:
+            return
+        
+        self.__thread = threading.Thread( target = self.run, args = ( delay, ), daemon = True )
+        self.__thread.start()
+        
+        
+    def stop( self ):
+        """
+        Stops the steps, waiting for the current step to be sent
+        """
+        self.__stop.set()
+        self.wait()
+        
+        
+    def wait( self ):
+        """
+        Waits for steps running in the background to finish
+        """
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+            
+            
+    def statistics( self ):
+        """
+        Returns statistics of the lateness of the completed steps
+        
+        :returns: Dictionary with keys steps, latency, and the mean, min, max,
+            p50, p90 and p99 lateness in seconds, omitted if no steps completed
+        """
+        stats = { 'steps': len( self.__lateness ), 'latency': self.latency }
+        if not self.__lateness:
+            return stats
+        
+        import numpy as np
+        
+        lateness = np.array( self.__lateness )
+        stats.update( {
+            'mean': float( lateness.mean() ),
+            'min':  float( lateness.min() ),
+            'max':  float( lateness.max() )
+        } )
+        
+        for percentile, value in zip( ( 50, 90, 99 ), np.percentile( lateness, ( 50, 90, 99 ) ) ):
+            stats[ 'p{}'.format( percentile ) ] = float( value )
+            
+        return stats
+    
+    
+    #--- private methods ---
+    
+    def __wait( self, until ):
+        """
+        Waits until a monotonic time, sleeping then busy waiting for precision
+        
+        :returns: True if stopped
+        """
+        remaining = until - time.monotonic() - self.SPIN
+        if ( remaining > 0 ) and self.__stop.wait( remaining ):
+            return True
+        
+        while time.monotonic() < until:
+            pass
+        
+        return self.__stop.is_set()
+        
 
 
 # In[6]:
 
 
+# ps = PowerSupply()
+
+
+# In[7]:
+
+
+# ps.connect()
+
+
+# In[8]:
+
+
+# ps.id
+
+
+# In[9]:
+
+
 # del ps
 
 
@@ -0,0 +1,905 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Power Supply Daemon
+# Command line control of the power supply through a background daemon holding the session open
+#
+# The daemon owns the instrument session and multiplexes it between clients,
+# so several processes, e.g. a logger, the GUI and test scripts, can share one supply.
+# Each client has its own queue of requests. The queues are served round robin,
+# one request per client per round, and the structured commands of a round
+# are sent to the instrument as a single message.
+# Telemetry is measured once and fanned out to all subscribed clients.
+# Each client has its own writer, so a client not reading does not stall the others,
+# telemetry samples are dropped for a client that falls behind.
+#
+# ## CLI
+# `python power_supply_daemon.py [options] <command> [arguments]`
+#
+# The first command starts the daemon if it is not running,
+# later commands reuse its open connection.
+# The daemon exits after **--idle** seconds without requests or subscribers.
+# Errors of a daemon started in the background are written to its log,
+# next to its Unix socket or in the temporary directory, see daemon_log().
+# Use **--socket <path>** to listen on a Unix socket instead of loopback TCP.
+#
+# ### Commands
+# **write <msg>** Sends **msg** to the instrument
+#
+# **query <msg>** Sends **msg** to the instrument and prints its response
+#
+# **set-voltage <volts>** Sets the voltage
+#
+# **set-current <amps>** Sets the current
+#
+# **on** Turns the output on
+#
+# **off** Turns the output off
+#
+# **measure** Prints the measured voltage and current
+#
+# **snapshot** Prints the setpoints, output state and measurements as JSON
+#
+# **monitor** Prints telemetry samples of time, volts and amps until interrupted
+#
+# **daemon** Runs the daemon in the foreground
+#
+# **stop** Stops the daemon
+#
+# ### Protocol
+# Requests and responses are JSON objects, one per line.
+# Requests have the form `{ "op": <command>, "args": [ ... ] }`,
+# responses `{ "ok": true, "result": ... }` or `{ "ok": false, "error": <message> }`.
+# Requests may be pipelined, responses are returned in order.
+#
+# After a `subscribe` request telemetry samples are sent as `{ "telemetry": [ time, volts, amps ] }`,
+# with time from time.time(), interleaved with responses until `unsubscribe`.
+
+# In[1]:
+
+
+# standard imports
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+from collections import deque
+
+import power_supply_controller as psc
+
+
+# In[2]:
+
+
+#--- static variables ---
+
+HOST = '127.0.0.1'
+PORT = 54305
+IDLE_TIMEOUT = 600 # seconds
+START_TIMEOUT = 10 # seconds to wait for the daemon to start
+TELEMETRY_RATE = 10 # samples per second
+MAX_BATCH = 16 # requests sent in a single message
+TELEMETRY_BACKLOG = 10 # samples queued for a client before new samples are dropped
+CLOSE_TIMEOUT = 5 # seconds to flush responses to a disconnecting client
+
+
+# In[3]:
+
+
+class Job( object ):
+        """
+        A request queued by a client
+        """
+
+        __slots__ = ( 'op', 'args', 'client', 'callback' )
+
+        def __init__( self, op, args, client, callback ):
+            self.op = op
+            self.args = args
+            self.client = client
+            self.callback = callback # called with the response
+
+
+class PowerSupplyDaemon( socketserver.ThreadingTCPServer ):
+    """
+    Serves requests for a power supply on a local socket, holding its connection open
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    #--- static variables ---
+
+    # commands sent in a single message with those of other clients
+    # op -> ( function of args returning the SCPI commands, function of decoded query responses returning the result )
+    BATCHED = {
+        'set-voltage': ( lambda volts: [ psc.PowerSupply.voltage_level.message( float( volts ) ) ], None ),
+        'set-current': ( lambda amps: [ psc.PowerSupply.current_level.message( float( amps ) ) ], None ),
+        'on':          ( lambda: [ psc.PowerSupply.output_state.message( True ) ], None ),
+        'off':         ( lambda: [ psc.PowerSupply.output_state.message( False ) ], None ),
+        'measure':     (
+            lambda: [ psc.PowerSupply.measured_voltage.query_msg, psc.PowerSupply.measured_current.query_msg ],
+            lambda volts, amps: [ volts, amps ]
+        )
+    }
+
+
+    def __init__( self, inst, address = ( HOST, PORT ), idle = IDLE_TIMEOUT, rate = TELEMETRY_RATE ):
+        """
+        Connects to the power supply, then listens on the address,
+        so clients only reach a daemon holding a working connection
+        
+        :param inst: The PowerSupply to serve
+        :param address: The ( host, port ) to listen on, or the path of a Unix socket [Default: ( HOST, PORT )]
+        :param idle: Seconds without requests or subscribers before shutting down,
+            None to run forever [Default: IDLE_TIMEOUT]
+        :param rate: Telemetry samples per second [Default: TELEMETRY_RATE]
+        """
+        inst.connect()
+
+        if isinstance( address, str ):
+            # unix socket, remove stale socket of a previous daemon
+            self.address_family = socket.AF_UNIX
+            if os.path.exists( address ):
+                os.remove( address )
+
+        try:
+            socketserver.ThreadingTCPServer.__init__( self, address, DaemonHandler )
+
+        except:
+            inst.disconnect()
+            raise
+
+        self.inst = inst
+        self.idle = idle
+        self.rate = rate
+        self.last_request = time.monotonic()
+
+        self.operations = {
+            'write':       lambda msg: self.inst.write( msg ) and None, # bytes written are not reported
+            'query':       lambda msg: self.inst.query( msg ).strip(),
+            'set-voltage': lambda volts: setattr( self.inst, 'voltage', float( volts ) ),
+            'set-current': lambda amps: setattr( self.inst, 'current', float( amps ) ),
+            'on':          self.inst.on,
+            'off':         self.inst.off,
+            'measure':     self.inst.measure,
+            'snapshot':    self.inst.snapshot
+        }
+
+        #--- private instance variables ---
+        self.__queues = {} # client -> deque of jobs
+        self.__order = [] # clients, in order served
+        self.__next = 0 # index of the client served first next round
+        self.__pending = threading.Condition()
+        self.__stopped = False
+
+        self.__subscribers = set()
+        self.__telemetry = None # telemetry thread
+        self.__sampling = False # telemetry measurement queued
+
+
+    #--- public methods ---
+
+    def run( self ):
+        """
+        Serves until stopped or idle, then disconnects from the power supply
+        """
+        dispatcher = threading.Thread( target = self.__dispatch, daemon = True )
+        dispatcher.start()
+
+        if self.idle is not None:
+            threading.Thread( target = self.__watch_idle, daemon = True ).start()
+
+        try:
+            self.serve_forever()
+
+        finally:
+            with self.__pending:
+                self.__stopped = True
+                self.__pending.notify()
+
+            dispatcher.join()
+            self.server_close()
+            if self.address_family == socket.AF_UNIX:
+                os.remove( self.server_address )
+
+            self.inst.disconnect()
+
+
+    def register( self, client ):
+        """
+        Adds a client queue
+        """
+        with self.__pending:
+            self.__queues[ client ] = deque()
+            self.__order.append( client )
+
+
+    def unregister( self, client ):
+        """
+        Removes a client queue, dropping its pending requests
+        """
+        self.unsubscribe( client )
+        with self.__pending:
+            index = self.__order.index( client )
+            self.__order.remove( client )
+            if index < self.__next:
+                self.__next -= 1
+
+            del self.__queues[ client ]
+
+
+    def submit( self, client, request, callback ):
+        """
+        Queues a request of a client
+
+        :param client: The client submitting the request
+        :param request: Dictionary with the op and its args
+        :param callback: Function called with the response dictionary
+        """
+        self.last_request = time.monotonic()
+
+        op = request.get( 'op' )
+        if op not in self.operations:
+            callback( { 'ok': False, 'error': 'Unknown command {}'.format( op ) } )
+            return
+
+        with self.__pending:
+            self.__queues[ client ].append( Job( op, request.get( 'args', [] ), client, callback ) )
+            self.__pending.notify()
+
+
+    def subscribe( self, client ):
+        """
+        Sends telemetry samples to a client, starting telemetry if needed
+        """
+        with self.__pending:
+            self.__subscribers.add( client )
+            if ( self.__telemetry is None ) or ( not self.__telemetry.is_alive() ):
+                self.__telemetry = threading.Thread( target = self.__sample, daemon = True )
+                self.__telemetry.start()
+
+
+    def unsubscribe( self, client ):
+        """
+        Stops sending telemetry samples to a client
+        """
+        with self.__pending:
+            self.__subscribers.discard( client )
+
+
+    def stop( self ):
+        """
+        Stops serving, after the current request
+        """
+        threading.Thread( target = self.shutdown, daemon = True ).start()
+
+
+    #--- private methods ---
+
+    def __dispatch( self ):
+        while True:
+            with self.__pending:
+                while not (
+                    self.__stopped or
+                    any( self.__queues[ client ] for client in self.__order )
+                ):
+                    self.__pending.wait()
+
+                if self.__stopped:
+                    return
+
+                jobs = self.__take_round()
+
+            self.__run( jobs )
+
+
+    def __take_round( self ):
+        """
+        Takes the next request of each client with pending requests, up to MAX_BATCH,
+        starting after the last client served
+        """
+        jobs = []
+        count = len( self.__order )
+        for offset in range( count ):
+            index = ( self.__next + offset ) % count
+            queue = self.__queues[ self.__order[ index ] ]
+            if queue:
+                jobs.append( queue.popleft() )
+                if len( jobs ) == MAX_BATCH:
+                    self.__next = ( index + 1 ) % count
+                    return jobs
+
+        self.__next = ( self.__next + 1 ) % count if count else 0
+        return jobs
+
+
+    def __run( self, jobs ):
+        """
+        Runs a round of jobs, batching structured commands into a single message
+        """
+        batched = []
+        commands = []
+        for job in jobs:
+            if job.op not in self.BATCHED:
+                self.__run_single( job )
+                continue
+
+            try:
+                job_commands = self.BATCHED[ job.op ][ 0 ]( *job.args )
+
+            except Exception as err:
+                self.__respond( job, error = err )
+                continue
+
+            batched.append( ( job, job_commands ) )
+            commands += job_commands
+
+        if len( batched ) < 2:
+            for job, _ in batched:
+                self.__run_single( job )
+
+            return
+
+        try:
+            results = iter( self.inst.execute( commands ) )
+
+        except Exception:
+            # attribute the error to its request, batched commands are idempotent
+            self.inst.invalidate( sequence = False )
+            for job, _ in batched:
+                self.__run_single( job )
+
+            return
+
+        if any( not cmd.endswith( '?' ) for cmd in commands ):
+            # batched writes bypass the cached setpoints, the list memory is not changed
+            self.inst.invalidate( sequence = False )
+
+        for job, job_commands in batched:
+            parse = self.BATCHED[ job.op ][ 1 ]
+            responses = [ self.inst.decode( cmd, next( results ) ) for cmd in job_commands if cmd.endswith( '?' ) ]
+            try:
+                result = None if ( parse is None ) else parse( *responses )
+
+            except Exception as err:
+                self.__respond( job, error = err )
+
+            else:
+                self.__respond( job, result )
+
+
+    def __run_single( self, job ):
+        try:
+            result = self.operations[ job.op ]( *job.args )
+
+        except Exception as err:
+            self.__respond( job, error = err )
+
+        else:
+            self.__respond( job, result )
+
+
+    def __respond( self, job, result = None, error = None ):
+        if error is None:
+            response = { 'ok': True, 'result': result }
+
+        else:
+            response = { 'ok': False, 'error': '{}: {}'.format( type( error ).__name__, error ) }
+
+        try:
+            job.callback( response )
+
+        except Exception:
+            # client disconnected
+            pass
+
+
+    def __sample( self ):
+        period = 1 / self.rate
+        deadline = time.monotonic()
+
+        while True:
+            with self.__pending:
+                if self.__stopped or ( not self.__subscribers ):
+                    return
+
+                if not self.__sampling:
+                    # skip the sample if the previous one is still pending
+                    self.__sampling = True
+                    self.__queues.setdefault( self, deque() ).append(
+                        Job( 'measure', [], self, self.__broadcast )
+                    )
+                    if self not in self.__order:
+                        self.__order.append( self )
+
+                    self.__pending.notify()
+
+            # wait for next deadline, skipping missed ones
+            deadline += period
+            now = time.monotonic()
+            if deadline < now:
+                deadline += period* ( ( now - deadline ) // period + 1 )
+
+            time.sleep( deadline - now )
+
+
+    def __broadcast( self, response ):
+        self.__sampling = False
+        if not response[ 'ok' ]:
+            # skip failed sample
+            return
+
+        sample = { 'telemetry': [ time.time() ] + list( response[ 'result' ] ) }
+        with self.__pending:
+            subscribers = list( self.__subscribers )
+
+        for client in subscribers:
+            client.send( sample, telemetry = True )
+
+
+    def __watch_idle( self ):
+        while True:
+            if self.__subscribers:
+                self.last_request = time.monotonic()
+
+            remaining = self.last_request + self.idle - time.monotonic()
+            if remaining <= 0:
+                self.shutdown()
+                return
+
+            time.sleep( remaining )
+
+
+class DaemonHandler( socketserver.StreamRequestHandler ):
+    """
+    Handles a client connection, one JSON request per line
+
+    Requests are queued with the daemon. Responses and telemetry are queued
+    to the client's outbox, written by its own thread so the daemon never blocks on a client.
+    """
+
+    def setup( self ):
+        socketserver.StreamRequestHandler.setup( self )
+        self.__outbox = deque() # ( message, telemetry ) waiting to be written
+        self.__backlog = 0 # telemetry samples in the outbox
+        self.__ready = threading.Condition()
+        self.__closed = False
+
+        self.__writer = threading.Thread( target = self.__write, daemon = True )
+        self.__writer.start()
+        self.server.register( self )
+
+
+    def finish( self ):
+        self.server.unregister( self )
+        with self.__ready:
+            self.__closed = True
+            self.__ready.notify()
+
+        # flush queued responses, unless the client does not read them
+        self.__writer.join( CLOSE_TIMEOUT )
+        socketserver.StreamRequestHandler.finish( self )
+
+
+    def handle( self ):
+        control = {
+            'ping':        lambda: 'pong',
+            'subscribe':   lambda: self.server.subscribe( self ),
+            'unsubscribe': lambda: self.server.unsubscribe( self ),
+            'stop':        self.server.stop
+        }
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads( line.decode( 'utf-8' ) )
+
+            except ValueError:
+                self.send( { 'ok': False, 'error': 'Invalid request' } )
+                continue
+
+            op = request.get( 'op' )
+            if op in control:
+                # control requests are answered immediately
+                self.server.last_request = time.monotonic()
+                self.send( { 'ok': True, 'result': control[ op ]() } )
+                continue
+
+            self.server.submit( self, request, self.send )
+
+
+    def send( self, message, telemetry = False ):
+        """
+        Queues a message to the client, without blocking
+
+        :param message: JSON serializable message
+        :param telemetry: Whether the message is a telemetry sample,
+            dropped if TELEMETRY_BACKLOG samples are waiting to be written [Default: False]
+        """
+        with self.__ready:
+            if self.__closed:
+                return
+
+            if telemetry:
+                if self.__backlog >= TELEMETRY_BACKLOG:
+                    # client is not keeping up
+                    return
+
+                self.__backlog += 1
+
+            self.__outbox.append( ( message, telemetry ) )
+            self.__ready.notify()
+
+
+    #--- private methods ---
+
+    def __write( self ):
+        """
+        Writes queued messages to the client, until closed and flushed
+        """
+        while True:
+            with self.__ready:
+                while not ( self.__outbox or self.__closed ):
+                    self.__ready.wait()
+
+                if not self.__outbox:
+                    return
+
+                message, telemetry = self.__outbox.popleft()
+                if telemetry:
+                    self.__backlog -= 1
+
+            try:
+                self.wfile.write( ( json.dumps( message ) + '\n' ).encode( 'utf-8' ) )
+                self.wfile.flush()
+
+            except ( OSError, ValueError ):
+                # client disconnected
+                with self.__ready:
+                    self.__closed = True
+                    self.__outbox.clear()
+
+                return
+
+
+# In[4]:
+
+
+class DaemonClient( object ):
+    """
+    Sends requests to a power supply daemon
+    """
+
+    def __init__( self, address = ( HOST, PORT ), timeout = 30 ):
+        """
+        :param address: The ( host, port ) of the daemon, or the path of its Unix socket [Default: ( HOST, PORT )]
+        :param timeout: Seconds to wait for a response [Default: 30]
+        """
+        self.address = address
+        self.timeout = timeout
+
+        self.__sock = None
+        self.__file = None
+        self.__samples = deque() # telemetry received while waiting for responses
+
+
+    def __enter__( self ):
+        return self
+
+
+    def __exit__( self, *exc ):
+        self.close()
+
+
+    #--- public methods ---
+
+    def connect( self ):
+        """
+        Connects to the daemon
+
+        :raises ConnectionError: If the daemon is not running
+        """
+        if self.__sock is not None:
+            return
+
+        if isinstance( self.address, str ):
+            sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            sock.settimeout( self.timeout )
+            try:
+                sock.connect( self.address )
+
+            except FileNotFoundError:
+                sock.close()
+                raise ConnectionRefusedError( 'Daemon not running at {}'.format( self.address ) )
+
+            except OSError:
+                sock.close()
+                raise
+
+        else:
+            sock = socket.create_connection( self.address, timeout = self.timeout )
+            sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        self.__sock = sock
+        self.__file = sock.makefile( 'rwb' )
+
+
+    def close( self ):
+        if self.__sock is not None:
+            self.__file.close()
+            self.__sock.close()
+            self.__sock = None
+            self.__file = None
+
+
+    def request( self, op, *args ):
+        """
+        Runs a command on the daemon
+
+        :param op: The command
+        :param args: Arguments of the command
+        :returns: The result
+        :raises Exception: If the command failed
+        """
+        self.connect()
+
+        self.__file.write( ( json.dumps( { 'op': op, 'args': args } ) + '\n' ).encode( 'utf-8' ) )
+        self.__file.flush()
+
+        while True:
+            response = self.__receive()
+            if 'telemetry' in response:
+                self.__samples.append( response[ 'telemetry' ] )
+                continue
+
+            if not response[ 'ok' ]:
+                raise Exception( response[ 'error' ] )
+
+            return response.get( 'result' )
+
+
+    def subscribe( self ):
+        """
+        Subscribes to the telemetry of the daemon
+        """
+        self.request( 'subscribe' )
+
+
+    def unsubscribe( self ):
+        """
+        Unsubscribes from the telemetry of the daemon
+        """
+        self.request( 'unsubscribe' )
+
+
+    def samples( self ):
+        """
+        Yields telemetry samples of [ time, volts, amps ], after subscribing
+        """
+        while True:
+            while self.__samples:
+                yield self.__samples.popleft()
+
+            response = self.__receive( timeout = None )
+            if 'telemetry' in response:
+                yield response[ 'telemetry' ]
+
+
+    def ensure_daemon( self, daemon_args = () ):
+        """
+        Connects to the daemon, starting it in the background if it is not running
+
+        :param daemon_args: Command line options passed to the daemon [Default: ()]
+        """
+        try:
+            self.connect()
+            return
+
+        except ConnectionError:
+            pass
+
+        log = daemon_log( self.address )
+        process = start_daemon( daemon_args, log )
+
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                self.connect()
+                return
+
+            except ConnectionError:
+                if process.poll() is not None:
+                    # daemon exited, report its error
+                    raise ConnectionError( 'Could not start daemon, {}'.format( read_error( log ) ) )
+
+                if time.monotonic() > deadline:
+                    raise ConnectionError( 'Could not start daemon, see {}'.format( log ) )
+
+                time.sleep( 0.05 )
+
+
+    #--- private methods ---
+
+    def __receive( self, timeout = False ):
+        """
+        Reads a message from the daemon
+
+        :param timeout: Seconds to wait, None to wait forever [Default: False, the client timeout]
+        """
+        if timeout is not False:
+            self.__sock.settimeout( timeout )
+
+        try:
+            line = self.__file.readline()
+
+        finally:
+            if timeout is not False:
+                self.__sock.settimeout( self.timeout )
+
+        if not line:
+            self.close()
+            raise ConnectionError( 'Daemon closed the connection' )
+
+        return json.loads( line.decode( 'utf-8' ) )
+
+
+def daemon_log( address ):
+    """
+    Returns the path of the log of a daemon started in the background
+
+    :param address: The ( host, port ) of the daemon, or the path of its Unix socket
+    """
+    if isinstance( address, str ):
+        return address + '.log'
+
+    return os.path.join( tempfile.gettempdir(), 'pws4305-daemon-{}.log'.format( address[ 1 ] ) )
+
+
+def read_error( log ):
+    """
+    Returns the last line of a daemon log, its error if the daemon exited
+    """
+    try:
+        with open( log ) as f:
+            lines = [ line.strip() for line in f if line.strip() ]
+
+    except OSError:
+        lines = []
+
+    return lines[ -1 ] if lines else 'no error reported'
+
+
+def start_daemon( daemon_args = (), log = None ):
+    """
+    Starts the daemon in a detached background process
+
+    :param daemon_args: Command line options passed to the daemon [Default: ()]
+    :param log: Path of the file errors of the daemon are written to,
+        replaced on each start. If None they are discarded. [Default: None]
+    :returns: The Popen of the daemon
+    """
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs[ 'creationflags' ] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+
+    else:
+        kwargs[ 'start_new_session' ] = True
+
+    stderr = subprocess.DEVNULL if ( log is None ) else open( log, 'w' )
+    try:
+        return subprocess.Popen(
+            [ sys.executable, os.path.abspath( __file__ ) ] + list( daemon_args ) + [ 'daemon' ],
+            stdin = subprocess.DEVNULL,
+            stdout = subprocess.DEVNULL,
+            stderr = stderr,
+            close_fds = True,
+            **kwargs
+        )
+
+    finally:
+        if log is not None:
+            # the daemon holds its own handle
+            stderr.close()
+
+
+# # CLI
+
+# In[5]:
+
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = 'Tektronix PWS4305 power supply control' )
+    parser.add_argument( '--rid', help = 'Resource id of the power supply, used when starting the daemon' )
+    parser.add_argument( '--backend', default = '', help = 'pyvisa backend, used when starting the daemon' )
+    parser.add_argument( '--port', type = int, default = PORT, help = 'Local port of the daemon [Default: {}]'.format( PORT ) )
+    parser.add_argument( '--socket', help = 'Unix socket of the daemon, used instead of the port' )
+    parser.add_argument( '--idle', type = float, default = IDLE_TIMEOUT, help = 'Seconds without requests before the daemon exits [Default: {}]'.format( IDLE_TIMEOUT ) )
+    parser.add_argument( '--rate', type = float, default = TELEMETRY_RATE, help = 'Telemetry samples per second [Default: {}]'.format( TELEMETRY_RATE ) )
+    parser.add_argument( 'command', choices = (
+        'write', 'query', 'set-voltage', 'set-current', 'on', 'off', 'measure', 'snapshot', 'monitor', 'daemon', 'stop'
+    ) )
+    parser.add_argument( 'args', nargs = '*' )
+    args = parser.parse_args( argv )
+
+    address = ( HOST, args.port ) if ( args.socket is None ) else os.path.abspath( args.socket )
+
+    if args.command == 'daemon':
+        if args.backend == '@simulated':
+            import simulated_instrument
+
+        inst = psc.PowerSupply( rid = args.rid, backend = args.backend )
+        try:
+            daemon = PowerSupplyDaemon( inst, address, args.idle, args.rate )
+
+        except Exception as err:
+            print( '{}: {}'.format( type( err ).__name__, err ), file = sys.stderr, flush = True )
+            return 1
+
+        daemon.run()
+        return 0
+
+    with DaemonClient( address ) as client:
+        if args.command == 'stop':
+            try:
+                client.request( 'stop' )
+
+            except ConnectionError:
+                pass
+
+            return 0
+
+        daemon_args = [
+            '--idle', str( args.idle ), '--rate', str( args.rate ), '--backend', args.backend
+        ]
+        daemon_args += [ '--port', str( args.port ) ] if ( args.socket is None ) else [ '--socket', address ]
+        if args.rid is not None:
+            daemon_args += [ '--rid', args.rid ]
+
+        try:
+            client.ensure_daemon( daemon_args )
+
+        except ConnectionError as err:
+            print( err, file = sys.stderr )
+            return 1
+
+        if args.command == 'monitor':
+            client.subscribe()
+            try:
+                for sample in client.samples():
+                    print( '{} {} {}'.format( *sample ), flush = True )
+
+            except ( KeyboardInterrupt, BrokenPipeError ):
+                pass
+
+            return 0
+
+        try:
+            result = client.request( args.command, *args.args )
+
+        except Exception as err:
+            print( err, file = sys.stderr )
+            return 1
+
+    if args.command == 'measure':
+        print( '{} {}'.format( *result ) )
+
+    elif args.command == 'snapshot':
+        print( json.dumps( result ) )
+
+    elif result is not None:
+        print( result )
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
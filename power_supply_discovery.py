@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Power Supply Discovery
+# Finds PWS4305 power supplies, caching them on disk so startup does not rescan the bus
+#
+# Candidate resources are listed by the Tektronix vendor id and PWS4305 product id,
+# then probed concurrently with *IDN? using a short timeout.
+# Discovered supplies are cached by serial number. Cached entries are not probed until used,
+# connecting to a supply whose cached resource fails or has a different serial rescans the bus.
+# Probed sessions are returned to the resource pool, so connecting to a discovered supply reuses them.
+#
+# ## API
+#
+# #### Examples
+# `discovery = Discovery()`
+#
+# `discovery.supplies()` Dictionary of serial to resource id, from the cache if available
+#
+# `ps = discovery.connect( 'C011451' )` Connected PowerSupply with the serial
+#
+# `fleet = Fleet( discovery.supplies().values() )`
+#
+# ### Methods
+# **Discovery( backend, cache, timeout )** Creates a discovery, with cache the path of the cache file
+#
+# **scan()** Probes the bus, updating the cache
+#
+# **supplies( refresh )** Returns the discovered supplies, scanning if not cached or refresh is True
+#
+# **resolve( serial )** Returns the resource id of a supply
+#
+# **connect( serial )** Returns a connected PowerSupply, rescanning if its cached resource is stale
+
+# In[1]:
+
+
+# standard imports
+import os
+import json
+import time
+import threading
+from concurrent import futures
+
+import scpi_instrument as scpi
+import power_supply_controller as psc
+
+
+# In[2]:
+
+
+#--- static variables ---
+
+VENDOR_ID = '0x0699' # Tektronix
+PRODUCT_ID = '0x0392' # PWS4305
+RESOURCE_QUERY = '?*::{}::{}::?*::INSTR'.format( VENDOR_ID, PRODUCT_ID )
+PROBE_TIMEOUT = 0.5 # seconds
+MAX_PROBES = 16 # concurrent probes
+CACHE_PATH = os.path.join( os.path.expanduser( '~' ), '.pws4305', 'discovery.json' )
+
+
+# In[3]:
+
+
+class DiscoveryCache( object ):
+        """
+        Discovered supplies, stored on disk as JSON
+
+        Entries are kept by backend and serial, as dictionaries with keys
+        rid, the resource id, idn, the *IDN? response, and seen, the time.time() it was last probed.
+        """
+
+        def __init__( self, path = CACHE_PATH ):
+            """
+            :param path: Path of the cache file, None to only cache in memory [Default: CACHE_PATH]
+            """
+            self.path = path
+            self.__lock = threading.Lock()
+            self.__entries = None # backend -> serial -> entry, loaded on first use
+
+
+        def entries( self, backend = '' ):
+            """
+            Returns the cached supplies of a backend
+
+            :param backend: The pyvisa backend [Default: '']
+            :returns: Dictionary of serial to entry
+            """
+            with self.__lock:
+                return dict( self.__load().get( backend, {} ) )
+
+
+        def update( self, entries, backend = '', replace = False ):
+            """
+            Updates the cached supplies of a backend, saving the cache
+
+            :param entries: Dictionary of serial to entry
+            :param backend: The pyvisa backend [Default: '']
+            :param replace: Replace all entries of the backend, e.g. after a full scan [Default: False]
+            """
+            with self.__lock:
+                cached = self.__load()
+                if replace or ( backend not in cached ):
+                    cached[ backend ] = {}
+
+                cached[ backend ].update( entries )
+                self.__save()
+
+
+        def remove( self, serial, backend = '' ):
+            """
+            Removes a supply from the cache, saving the cache
+            """
+            with self.__lock:
+                if self.__load().get( backend, {} ).pop( serial, None ) is not None:
+                    self.__save()
+
+
+        #--- private methods ---
+
+        def __load( self ):
+            """
+            Loads the cache file if not loaded, an unreadable file is treated as empty
+            """
+            if self.__entries is None:
+                self.__entries = {}
+                if ( self.path is not None ) and os.path.exists( self.path ):
+                    try:
+                        with open( self.path ) as f:
+                            self.__entries = json.load( f )
+
+                    except ( OSError, ValueError ):
+                        pass
+
+            return self.__entries
+
+
+        def __save( self ):
+            """
+            Writes the cache file, replacing it atomically
+            """
+            if self.path is None:
+                return
+
+            try:
+                os.makedirs( os.path.dirname( os.path.abspath( self.path ) ), exist_ok = True )
+                tmp = '{}.{}.tmp'.format( self.path, os.getpid() )
+                with open( tmp, 'w' ) as f:
+                    json.dump( self.__entries, f, indent = 2 )
+
+                os.replace( tmp, self.path )
+
+            except OSError:
+                # cache is an optimization, discovery works without it
+                pass
+
+
+# In[4]:
+
+
+class Discovery( object ):
+    """
+    Discovers PWS4305 power supplies
+    """
+
+    def __init__( self, backend = '', cache = CACHE_PATH, timeout = PROBE_TIMEOUT ):
+        """
+        :param backend: The pyvisa backend to discover on [Default: '']
+        :param cache: Path of the cache file, None to not cache on disk [Default: CACHE_PATH]
+        :param timeout: Timeout of probes in seconds [Default: PROBE_TIMEOUT]
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.cache = DiscoveryCache( cache )
+
+
+    #--- public methods ---
+
+    def candidates( self ):
+        """
+        Lists the resources with the vendor and product ids of the PWS4305, without probing them
+
+        :returns: List of resource ids
+        """
+        rm = scpi.resource_pool.manager( self.backend )
+        return [ rid for rid in rm.list_resources( RESOURCE_QUERY ) if Discovery.is_candidate( rid ) ]
+
+
+    def probe( self, rid ):
+        """
+        Queries the identity of a resource, with a short timeout
+
+        A resource leased by an instrument of this process is not queried,
+        it is identified by the response kept with its session, or its cache entry.
+
+        :param rid: The resource id
+        :returns: Tuple of ( serial, entry ) of the cache
+        """
+        leased = scpi.resource_pool.leased( rid, self.backend )
+        if leased is not None:
+            idn = scpi.resource_pool.info( leased ).get( 'idn' )
+            if idn is None:
+                cached = [
+                    entry[ 'idn' ] for entry in self.cache.entries( self.backend ).values()
+                    if entry[ 'rid' ] == rid
+                ]
+
+                if not cached:
+                    raise Exception( 'Can not identify {}, it is in use'.format( rid ) )
+
+                idn = cached[ 0 ]
+
+            return ( Discovery.identify( idn ), { 'rid': rid, 'idn': idn, 'seen': time.time() } )
+
+        # query the session directly, leaving the instrument in local control
+        resource = scpi.resource_pool.acquire( rid, self.backend )
+        try:
+            resource.timeout = self.timeout* 1000
+            resource.read_termination = '\n'
+            resource.write_termination = '\n'
+
+            resource.write( '*IDN?' )
+            idn = resource.read().strip()
+
+        except:
+            # a late response would be read by the next lease
+            scpi.resource_pool.release( resource, close = True )
+            raise
+
+        # kept with the session, so connecting to the supply does not query it again
+        scpi.resource_pool.info( resource )[ 'idn' ] = idn
+        scpi.resource_pool.release( resource )
+        return ( Discovery.identify( idn ), { 'rid': rid, 'idn': idn, 'seen': time.time() } )
+
+
+    def scan( self ):
+        """
+        Probes the candidate resources concurrently, replacing the cached supplies
+
+        :returns: Dictionary of serial to resource id
+        """
+        rids = self.candidates()
+        found = {}
+        if rids:
+            with futures.ThreadPoolExecutor( max_workers = min( len( rids ), MAX_PROBES ) ) as executor:
+                for probe in executor.map( self.__try_probe, rids ):
+                    if probe is not None:
+                        found[ probe[ 0 ] ] = probe[ 1 ]
+
+        self.cache.update( found, self.backend, replace = True )
+        return { serial: entry[ 'rid' ] for serial, entry in found.items() }
+
+
+    def supplies( self, refresh = False ):
+        """
+        Returns the discovered supplies, scanning only if none are cached
+
+        :param refresh: Scan even if supplies are cached [Default: False]
+        :returns: Dictionary of serial to resource id
+        """
+        if not refresh:
+            cached = self.cache.entries( self.backend )
+            if cached:
+                return { serial: entry[ 'rid' ] for serial, entry in cached.items() }
+
+        return self.scan()
+
+
+    def resolve( self, serial = None, refresh = False ):
+        """
+        Returns the resource id of a supply
+
+        :param serial: The serial number, None if only one supply is connected [Default: None]
+        :param refresh: Scan even if the supply is cached [Default: False]
+        :returns: The resource id
+        """
+        supplies = self.supplies( refresh )
+        if ( serial is not None ) and ( serial not in supplies ) and ( not refresh ):
+            # not cached, the supply may have been connected since the last scan
+            supplies = self.scan()
+
+        if serial is None:
+            if len( supplies ) != 1:
+                raise Exception( 'Can not resolve supply, {} found, specify a serial'.format( len( supplies ) ) )
+
+            return next( iter( supplies.values() ) )
+
+        if serial not in supplies:
+            raise Exception( 'Can not resolve supply, {} not found'.format( serial ) )
+
+        return supplies[ serial ]
+
+
+    def connect( self, serial = None, **kwargs ):
+        """
+        Connects to a supply, using its cached resource id if valid
+
+        The cached resource is validated by connecting to it,
+        if it fails or has a different serial the bus is rescanned.
+
+        :param serial: The serial number, None if only one supply is connected [Default: None]
+        :param kwargs: Keyword arguments of the PowerSupply
+        :returns: The connected PowerSupply
+        """
+        rid = self.resolve( serial )
+        inst = self.__connect( rid, serial, **kwargs )
+        if inst is not None:
+            return inst
+
+        rid = self.resolve( serial, refresh = True )
+        inst = self.__connect( rid, serial, **kwargs )
+        if inst is None:
+            raise Exception( 'Can not connect, {} does not respond'.format( rid ) )
+
+        return inst
+
+
+    #--- static methods ---
+
+    @staticmethod
+    def identify( idn ):
+        """
+        Returns the serial number of a PWS4305 from its *IDN? response
+
+        :param idn: The *IDN? response
+        :returns: The serial number
+        """
+        fields = [ field.strip() for field in idn.split( ',' ) ]
+        if ( len( fields ) < 3 ) or ( 'PWS4305' not in fields[ 1 ].upper() ):
+            raise Exception( 'Can not identify supply, {} is not a PWS4305'.format( idn ) )
+
+        return fields[ 2 ]
+
+
+    @staticmethod
+    def is_candidate( rid ):
+        """
+        Returns if a resource id has the vendor and product ids of the PWS4305
+        """
+        parts = rid.upper().split( '::' )
+        return (
+            ( len( parts ) > 3 ) and
+            ( parts[ 1 ] == VENDOR_ID.upper() ) and
+            ( parts[ 2 ] == PRODUCT_ID.upper() )
+        )
+
+
+    #--- private methods ---
+
+    def __try_probe( self, rid ):
+        """
+        Probes a resource
+
+        :returns: Tuple of ( serial, entry ), or None if the resource does not respond
+        """
+        try:
+            return self.probe( rid )
+
+        except Exception:
+            return None
+
+
+    def __connect( self, rid, serial = None, **kwargs ):
+        """
+        Connects to a resource, checking its serial
+
+        :returns: The connected PowerSupply, or None if it fails or has a different serial
+        """
+        inst = psc.PowerSupply( rid = rid, backend = self.backend, **kwargs )
+        try:
+            inst.connect()
+            if ( serial is None ) or ( Discovery.identify( inst.id ) == serial ):
+                return inst
+
+        except Exception:
+            pass
+
+        try:
+            inst.disconnect()
+
+        except Exception:
+            pass
+
+        return None
+
+
+# # CLI
+
+# In[5]:
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser( description = 'Discover PWS4305 power supplies' )
+    parser.add_argument( '--backend', default = '', help = 'The pyvisa backend [Default: \'\']' )
+    parser.add_argument( '--refresh', action = 'store_true', help = 'Rescan the bus instead of using the cache' )
+    args = parser.parse_args()
+
+    for serial, rid in sorted( Discovery( args.backend ).supplies( args.refresh ).items() ):
+        print( '{}\t{}'.format( serial, rid ) )
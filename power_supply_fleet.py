@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Power Supply Fleet
+# Parallel control of many power supplies
+#
+# Operations are fanned out to all supplies of the fleet concurrently,
+# on an executor with a single thread per supply, so commands to a supply stay in order
+# while a rack wide operation takes about as long as the slowest supply.
+#
+# Errors are isolated per supply. A failing supply does not stop the operation on the others,
+# its error is returned in the results instead of raised.
+#
+# ## API
+#
+# #### Examples
+# `fleet = Fleet( [ 'USB0::0x0699::0x0392::C011451::INSTR', 'USB0::0x0699::0x0392::C011452::INSTR' ] )`
+#
+# `fleet.connect()`
+#
+# `fleet.set_voltage( 5 )`
+#
+# `fleet.set_voltage( { 'USB0::0x0699::0x0392::C011451::INSTR': 5, 'USB0::0x0699::0x0392::C011452::INSTR': 12 } )`
+#
+# `results = fleet.measure()`
+#
+# `results.values` Dictionary of resource id to ( volts, amps ), of the supplies that succeeded
+#
+# `results.errors` Dictionary of resource id to exception, of the supplies that failed
+#
+# `results.raise_errors()` Raises a FleetError if any supply failed
+#
+# ### Methods
+# **Fleet( supplies, timeout, backend, cache )** Creates a fleet of PowerSupplies or resource ids
+#
+# **run( func, *args, rids = None, run_timeout = None )** Calls func( supply, *args ) on each supply concurrently
+#
+# **connect()**, **disconnect()**, **write( msg )**, **query( msg )**, **execute( commands )**
+#
+# **set_voltage( volts )**, **set_current( amps )**, **on()**, **off()**, **measure()**, **snapshot()**, **wait_settled()**
+#
+# Arguments of setpoints can be a single value for all supplies,
+# or a dictionary of resource id to value to set only those supplies.
+
+# In[1]:
+
+
+# standard imports
+import time
+from concurrent import futures
+
+import power_supply_controller as psc
+
+
+# In[2]:
+
+
+class Result( object ):
+        """
+        Result of an operation on a single supply
+        """
+
+        __slots__ = ( 'rid', 'value', 'error', 'duration' )
+
+        def __init__( self, rid, value = None, error = None, duration = None ):
+            self.rid = rid
+            self.value = value
+            self.error = error # exception raised by the operation, or None
+            self.duration = duration # seconds
+
+
+        @property
+        def ok( self ):
+            return self.error is None
+
+
+        def __repr__( self ):
+            if self.ok:
+                return 'Result( {}, {!r} )'.format( self.rid, self.value )
+
+            return 'Result( {}, error = {!r} )'.format( self.rid, self.error )
+
+
+class FleetError( Exception ):
+        """
+        Raised for operations failing on some supplies of a fleet
+        """
+
+        def __init__( self, errors ):
+            """
+            :param errors: Dictionary of resource id to exception
+            """
+            self.errors = errors
+            Exception.__init__( self, '; '.join(
+                '{}: {}'.format( rid, err ) for rid, err in errors.items()
+            ) )
+
+
+class FleetResults( object ):
+        """
+        Results of an operation on a fleet, by resource id
+        """
+
+        def __init__( self, results = None ):
+            """
+            :param results: Dictionary of resource id to Result [Default: None]
+            """
+            self.__results = {} if ( results is None ) else results
+
+
+        def __getitem__( self, rid ):
+            return self.__results[ rid ]
+
+
+        def __setitem__( self, rid, result ):
+            self.__results[ rid ] = result
+
+
+        def __iter__( self ):
+            return iter( self.__results )
+
+
+        def __len__( self ):
+            return len( self.__results )
+
+
+        def __repr__( self ):
+            return 'FleetResults( {!r} )'.format( list( self.__results.values() ) )
+
+
+        def items( self ):
+            return self.__results.items()
+
+
+        @property
+        def ok( self ):
+            """
+            Whether the operation succeeded on all supplies
+            """
+            return all( res.ok for res in self.__results.values() )
+
+
+        @property
+        def values( self ):
+            """
+            Dictionary of resource id to value, of the supplies that succeeded
+            """
+            return { rid: res.value for rid, res in self.__results.items() if res.ok }
+
+
+        @property
+        def errors( self ):
+            """
+            Dictionary of resource id to exception, of the supplies that failed
+            """
+            return { rid: res.error for rid, res in self.__results.items() if not res.ok }
+
+
+        @property
+        def duration( self ):
+            """
+            Seconds of the slowest supply
+            """
+            return max( ( res.duration for res in self.__results.values() ), default = 0 )
+
+
+        def raise_errors( self ):
+            """
+            Raises a FleetError if the operation failed on any supply
+
+            :returns: Dictionary of resource id to value
+            """
+            errors = self.errors
+            if errors:
+                raise FleetError( errors )
+
+            return self.values
+
+
+# In[3]:
+
+
+class Fleet( object ):
+    """
+    A fleet of power supplies, controlled concurrently
+    """
+
+    def __init__( self, supplies = (), timeout = 10, backend = '', cache = None ):
+        """
+        :param supplies: Iterable of PowerSupplies or resource ids [Default: ()]
+        :param timeout: The communication timeout in seconds, of created PowerSupplies [Default: 10]
+        :param backend: The pyvisa backend, of created PowerSupplies [Default: '']
+        :param cache: Setpoint caching, of created PowerSupplies, see PowerSupply [Default: None]
+        """
+        self.__timeout = timeout
+        self.__backend = backend
+        self.__cache = cache
+
+        self.__supplies = {}  # rid -> PowerSupply
+        self.__executors = {} # rid -> executor, serializing commands to the supply
+
+        for supply in supplies:
+            self.add( supply )
+
+
+    def __del__( self ):
+        if hasattr( self, '_Fleet__executors' ):
+            self.close()
+
+
+    def __enter__( self ):
+        self.connect().raise_errors()
+        return self
+
+
+    def __exit__( self, *exc ):
+        try:
+            self.disconnect()
+
+        finally:
+            self.close()
+
+
+    def __len__( self ):
+        return len( self.__supplies )
+
+
+    def __iter__( self ):
+        return iter( list( self.__supplies.values() ) )
+
+
+    def __contains__( self, rid ):
+        return rid in self.__supplies
+
+
+    def __getitem__( self, rid ):
+        return self.__supplies[ rid ]
+
+
+    #--- public methods ---
+
+    @property
+    def rids( self ):
+        """
+        List of the resource ids of the supplies
+        """
+        return list( self.__supplies )
+
+
+    def add( self, supply ):
+        """
+        Adds a supply to the fleet
+
+        :param supply: The PowerSupply, or its resource id
+        :returns: The PowerSupply
+        """
+        if isinstance( supply, str ):
+            supply = psc.PowerSupply(
+                timeout = self.__timeout,
+                rid = supply,
+                cache = self.__cache,
+                backend = self.__backend
+            )
+
+        if supply.rid in self.__supplies:
+            raise Exception( 'Can not add supply, {} is already in the fleet'.format( supply.rid ) )
+
+        self.__supplies[ supply.rid ] = supply
+        self.__executors[ supply.rid ] = futures.ThreadPoolExecutor( max_workers = 1 )
+        return supply
+
+
+    def remove( self, rid ):
+        """
+        Removes a supply from the fleet, after its pending operations finish.
+        The supply is not disconnected.
+
+        :param rid: The resource id of the supply
+        :returns: The PowerSupply
+        """
+        supply = self.__supplies.pop( rid )
+        self.__executors.pop( rid ).shutdown( wait = True )
+        return supply
+
+
+    def close( self ):
+        """
+        Shuts down the executors, after pending operations finish
+        """
+        for executor in self.__executors.values():
+            executor.shutdown( wait = False )
+
+
+    def run( self, func, *args, rids = None, run_timeout = None ):
+        """
+        Calls a function on the supplies concurrently
+
+        :param func: The function, called as func( supply, *args )
+        :param args: Arguments passed to the function
+        :param rids: Resource ids of the supplies to run on, None for all [Default: None]
+        :param run_timeout: Seconds to wait for the supplies, None to wait until all finish.
+            Supplies not finished in time have a TimeoutError as result,
+            but their operation is not cancelled. [Default: None]
+        :returns: FleetResults of the function's return values,
+            with an error for resource ids not in the fleet
+        """
+        if rids is None:
+            rids = self.rids
+
+        results = FleetResults()
+        pending = {}
+        for rid in rids:
+            executor = self.__executors.get( rid )
+            if executor is None:
+                results[ rid ] = Result(
+                    rid, error = Exception( 'Can not run operation, {} is not in the fleet'.format( rid ) ), duration = 0
+                )
+                continue
+
+            pending[ rid ] = executor.submit( self.__call, rid, func, args )
+
+        deadline = None if ( run_timeout is None ) else ( time.monotonic() + run_timeout )
+        for rid, future in pending.items():
+            remaining = None if ( deadline is None ) else max( deadline - time.monotonic(), 0 )
+
+            try:
+                results[ rid ] = future.result( remaining )
+
+            except futures.TimeoutError:
+                results[ rid ] = Result(
+                    rid,
+                    error = TimeoutError( 'Can not complete operation, {} timed out'.format( rid ) ),
+                    duration = run_timeout
+                )
+
+        return results
+
+
+    def connect( self, **kwargs ):
+        return self.run( psc.PowerSupply.connect, **kwargs )
+
+
+    def disconnect( self, **kwargs ):
+        return self.run( psc.PowerSupply.disconnect, **kwargs )
+
+
+    def write( self, msg, **kwargs ):
+        return self.run( psc.PowerSupply.write, msg, **kwargs )
+
+
+    def query( self, msg, **kwargs ):
+        return self.run( psc.PowerSupply.query, msg, **kwargs )
+
+
+    def execute( self, commands, **kwargs ):
+        return self.run( psc.PowerSupply.execute, commands, **kwargs )
+
+
+    def set_voltage( self, volts, **kwargs ):
+        """
+        Sets the voltage of the supplies
+
+        :param volts: Voltage of all supplies,
+            or dictionary of resource id to voltage of the supplies to set
+        :returns: FleetResults
+        """
+        return self.__set( 'voltage', volts, **kwargs )
+
+
+    def set_current( self, amps, **kwargs ):
+        """
+        Sets the current of the supplies
+
+        :param amps: Current of all supplies,
+            or dictionary of resource id to current of the supplies to set
+        :returns: FleetResults
+        """
+        return self.__set( 'current', amps, **kwargs )
+
+
+    def on( self, **kwargs ):
+        return self.run( psc.PowerSupply.on, **kwargs )
+
+
+    def off( self, **kwargs ):
+        return self.run( psc.PowerSupply.off, **kwargs )
+
+
+    def measure( self, **kwargs ):
+        """
+        Measures the output of the supplies
+
+        :returns: FleetResults of ( volts, amps )
+        """
+        return self.run( psc.PowerSupply.measure, **kwargs )
+
+
+    def snapshot( self, **kwargs ):
+        """
+        Reads the setpoints, output state and measured output of the supplies
+
+        :returns: FleetResults of snapshot dictionaries, see PowerSupply.snapshot()
+        """
+        return self.run( psc.PowerSupply.snapshot, **kwargs )
+
+
+    def wait_settled( self, rids = None, run_timeout = None, **settle ):
+        """
+        Waits for the outputs of the supplies to settle
+
+        :param settle: Keyword arguments of PowerSupply.wait_settled(),
+            whose timeout bounds the wait of each supply
+        :returns: FleetResults of the settled ( volts, amps )
+        """
+        return self.run(
+            lambda supply: supply.wait_settled( **settle ),
+            rids = rids,
+            run_timeout = run_timeout
+        )
+
+
+    #--- private methods ---
+
+    def __set( self, name, value, rids = None, run_timeout = None ):
+        """
+        Sets a setpoint of the supplies
+
+        :param name: Name of the PowerSupply property
+        :param value: Value of all supplies, or dictionary of resource id to value
+        :param rids: Resource ids of the supplies to set, if a single value [Default: None, all]
+        :param run_timeout: See run() [Default: None]
+        :returns: FleetResults
+        """
+        if isinstance( value, dict ):
+            return self.run(
+                lambda supply: setattr( supply, name, value[ supply.rid ] ),
+                rids = list( value ),
+                run_timeout = run_timeout
+            )
+
+        return self.run( setattr, name, value, rids = rids, run_timeout = run_timeout )
+
+
+    def __call( self, rid, func, args ):
+        """
+        Calls a function on a supply, capturing its result or error
+
+        :returns: Result
+        """
+        start = time.perf_counter()
+        try:
+            value = func( self.__supplies[ rid ], *args )
+            return Result( rid, value, duration = time.perf_counter() - start )
+
+        except Exception as err:
+            return Result( rid, error = err, duration = time.perf_counter() - start )
+
+
+# # Examples
+
+# In[4]:
+
+
+# fleet = Fleet( [ 'USB0::0x0699::0x0392::C011451::INSTR', 'USB0::0x0699::0x0392::C011452::INSTR' ] )
+
+
+# In[5]:
+
+
+# fleet.connect().raise_errors()
+
+
+# In[6]:
+
+
+# fleet.set_voltage( 5 )
+# fleet.on()
+# fleet.measure().values
+
+
+# In[7]:
+
+
+# fleet.disconnect()
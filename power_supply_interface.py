@@ -21,6 +21,8 @@
 import os
 import sys
 import re
+import queue
+import threading
 from collections import namedtuple
 
 # PyQt
@@ -30,7 +32,8 @@ from PyQt5.QtCore import (
     Qt,
     QCoreApplication,
     QTimer,
-    QThread
+    QThread,
+    pyqtSignal
 )
 
 from PyQt5.QtWidgets import (
@@ -54,23 +57,169 @@ from PyQt5.QtWidgets import (
 # import import_ipynb # FREEZE
 import power_supply_controller as psc
 
-import visa
-
 
 # In[2]:
 
 
+class PowerSupplyWorker( QThread ):
+    """
+    Owns the power supply, running its commands from a queue on a separate thread
+    so the interface never waits on communication.
+    
+    Commands are submitted by name, results and errors are returned through signals.
+    Setpoints are kept in a single slot, so only their latest values are written
+    however many are submitted while the instrument is busy.
+    """
+    
+    #--- signals ---
+    result = pyqtSignal( str, object ) # command, result
+    error  = pyqtSignal( str, object ) # command, exception
+    
+    
+    #--- initializer ---
+    def __init__( self ):
+        super().__init__()
+        
+        self.__inst = None # the instrument, only accessed from the worker thread
+        self.__commands = queue.Queue()
+        
+        self.__setpoints_lock = threading.Lock()
+        self.__pending_setpoints = {} # latest unwritten setpoint of each parameter
+        
+        self.__handlers = {
+            'connect':    self.__connect,
+            'disconnect': self.__disconnect,
+            'on':         self.__on,
+            'off':        self.__off,
+            'setpoints':  self.__write_pending_setpoints
+        }
+        
+    
+    #--- public methods ---
+    
+    def submit( self, command, *args ):
+        """
+        Queues a command to be run
+        
+        :param command: Name of the command
+        :param args: Arguments passed to the command
+        """
+        self.__commands.put( ( command, args ) )
+        
+        
+    def submit_setpoints( self, setpoints ):
+        """
+        Stores setpoints to be written, replacing any pending value of the same parameter.
+        A write is queued only if none is pending.
+        
+        :param setpoints: Dictionary of parameter name to value
+        """
+        with self.__setpoints_lock:
+            queued = ( len( self.__pending_setpoints ) > 0 )
+            self.__pending_setpoints.update( setpoints )
+            
+        if not queued:
+            self.__commands.put( ( 'setpoints', () ) )
+        
+        
+    def stop( self ):
+        """
+        Stops the worker after the queued commands have run
+        """
+        self.__commands.put( None )
+        
+        
+    def run( self ):
+        while True:
+            item = self.__commands.get()
+            if item is None:
+                break
+                
+            command, args = item
+            try:
+                result = self.__handlers[ command ]( *args )
+                
+            except Exception as err:
+                self.error.emit( command, err )
+                
+            else:
+                self.result.emit( command, result )
+                
+        # release instrument on exit
+        try:
+            self.__disconnect()
+            
+        except Exception:
+            pass
+                
+    
+    #--- commands ---
+    
+    def __connect( self, voltage, current ):
+        if self.__inst is None:
+            inst = psc.PowerSupply()
+            inst.connect()
+            self.__inst = inst
+            
+        self.__setpoints( { 'voltage': voltage, 'current': current } )
+        return self.__inst.connected
+    
+    
+    def __disconnect( self ):
+        if self.__inst is not None:
+            try:
+                self.__inst.off()
+                self.__inst.disconnect( close = True ) # other processes can open the supply
+                
+            finally:
+                self.__inst = None
+            
+        return False
+    
+    
+    def __on( self ):
+        if self.__inst is not None:
+            self.__inst.on()
+    
+    
+    def __off( self ):
+        if self.__inst is not None:
+            self.__inst.off()
+            
+            
+    def __write_pending_setpoints( self ):
+        with self.__setpoints_lock:
+            setpoints = self.__pending_setpoints
+            self.__pending_setpoints = {}
+            
+        self.__setpoints( setpoints )
+        
+        
+    def __setpoints( self, setpoints ):
+        if ( self.__inst is not None ) and ( len( setpoints ) > 0 ):
+            with self.__inst.batch():
+                for name, value in setpoints.items():
+                    setattr( self.__inst, name, value )
+        
+
+
+# In[3]:
+
+
 class PowerSupplyInterface( QWidget ):
     
+    #--- static variables ---
+    SETPOINT_INTERVAL = 100 # minimum time between setpoint writes in ms
+    
     #--- window close ---
     def closeEvent( self, event ):
-        self.__delete_controller()
+        self.__stop_worker()
         event.accept()
         
     
     #--- destructor ---
     def __del__( self ):
-        self.__delete_controller()
+        self.__stop_worker()
         
     
     #--- initializer ---
@@ -85,9 +234,17 @@ class PowerSupplyInterface( QWidget ):
         self.img_greenLight = QtGui.QPixmap(  image_folder + 'green-light.png'  ).scaledToHeight( 32 )
         self.img_yellowLight = QtGui.QPixmap( image_folder + 'yellow-light.png' ).scaledToHeight( 32 )
         
-        self.inst   = None # the instrument
+        self.connected = False
+        
+        #--- worker ---
+        self.__worker = PowerSupplyWorker() # owns the instrument
         
         #--- timers ---
+        self.__pending_setpoints = {} # latest unwritten setpoint of each parameter
+        
+        self.__setpoint_timer = QTimer()
+        self.__setpoint_timer.setSingleShot( True )
+        self.__setpoint_timer.setInterval( self.SETPOINT_INTERVAL )
         
         
         #--- init UI ---
@@ -170,7 +327,7 @@ class PowerSupplyInterface( QWidget ):
     def __ui_settings_voltage( self, parent ):        
         sb_voltage = QDoubleSpinBox()
         sb_voltage.setMinimum( 0 )
-        sb_voltage.setMaximum( 30 ) 
+        sb_voltage.setMaximum( psc.PowerSupply.MAX_VOLTAGE )
         self.sb_voltage = sb_voltage
         
         lbl_voltage = QLabel( 'Voltage' )
@@ -185,7 +342,7 @@ class PowerSupplyInterface( QWidget ):
     def __ui_settings_current( self, parent ):        
         sb_current = QDoubleSpinBox()
         sb_current.setMinimum( 0 )
-        sb_current.setMaximum( 5 ) 
+        sb_current.setMaximum( psc.PowerSupply.MAX_CURRENT )
         self.sb_current = sb_current
         
         lbl_current = QLabel( 'Current' )
@@ -213,8 +370,14 @@ class PowerSupplyInterface( QWidget ):
         self.btn_connect.clicked.connect( self.toggle_connect )    
         self.btn_on.clicked.connect( self.toggle_on )
         
-        self.sb_voltage.valueChanged.connect( self.set_voltage )
-        self.sb_current.valueChanged.connect( self.set_current )
+        self.sb_voltage.valueChanged.connect( self.queue_voltage )
+        self.sb_current.valueChanged.connect( self.queue_current )
+        
+        self.__setpoint_timer.timeout.connect( self.flush_setpoints )
+        
+        self.__worker.result.connect( self.__handle_result )
+        self.__worker.error.connect( self.__handle_error )
+        self.__worker.start()
 
     
     #--- slot functions ---
@@ -226,39 +389,17 @@ class PowerSupplyInterface( QWidget ):
         # show waiting for communication
         self.lbl_status.setText( 'Waiting...' )
         self.lbl_statusLight.setPixmap( self.img_yellowLight )
-        self.repaint()
         
-        # create laser controller if doesn't already exist, connect
-        if self.inst is None:
-            try:
-                self.inst = psc.PowerSupply()
-                self.inst.connect()
-                
-            except Exception as err:
-                self.__update_connected_ui( False )
-                
-                warning = QMessageBox()
-                warning.setWindowTitle( 'Picoammeter Controller Error' )
-                warning.setText( 'Could not connect\n{}'.format( err ) )
-                warning.exec()
+        # connect, setting voltage and current, or disconnect
+        if not self.connected:
+            self.__worker.submit( 'connect', self.sb_voltage.value(), self.sb_current.value() )
             
         else:
             self.__delete_controller()
-        
-        # update ui
-        if self.inst is not None:
-            self.__update_connected_ui( self.inst.connected )
-            
-        else:
-            self.__update_connected_ui( False )
-            
-        # set voltage and current
-        self.set_voltage()
-        self.set_current()
 
         
     def toggle_on( self ):
-        if self.inst is None:
+        if not self.connected:
             # not connected
             return
         
@@ -273,39 +414,109 @@ class PowerSupplyInterface( QWidget ):
         
     
     def on( self ):
-        try:
-            self.inst.on()
-            
-        except visa.VisaIOError as err:
-            self.__handle_visa_error( err )
+        self.__worker.submit( 'on' )
     
     
     def off( self ):
-        try:
-            self.inst.off()
-            
-        except visa.VisaIOError as err:
-            self.__handle_visa_error( err )
+        self.__worker.submit( 'off' )
         
     
     def set_voltage( self ):
-        if self.inst is not None:
-            self.inst.voltage = self.sb_voltage.value()
+        if self.connected:
+            self.__worker.submit_setpoints( { 'voltage': self.sb_voltage.value() } )
         
         
     def set_current( self ):
-        if self.inst is not None:
-            self.inst.current = self.sb_current.value()
+        if self.connected:
+            self.__worker.submit_setpoints( { 'current': self.sb_current.value() } )
+            
+            
+    def queue_voltage( self, volts ):
+        self.__queue_setpoint( 'voltage', volts )
+        
+        
+    def queue_current( self, amps ):
+        self.__queue_setpoint( 'current', amps )
+        
+        
+    def flush_setpoints( self ):
+        """
+        Sends the latest pending setpoints to be written in a single message.
+        While not connected they are kept, and sent once the connection succeeds.
+        """
+        if ( not self.connected ) or ( len( self.__pending_setpoints ) == 0 ):
+            return
+        
+        pending = self.__pending_setpoints
+        self.__pending_setpoints = {}
+        self.__worker.submit_setpoints( pending )
         
         
     #--- helper functions ---
     
+    def __queue_setpoint( self, name, value ):
+        """
+        Stores the setpoint to be written,
+        replacing any pending value of the same parameter.
+        Writes are limited to one every SETPOINT_INTERVAL.
+        """
+        self.__pending_setpoints[ name ] = value
+        
+        if not self.__setpoint_timer.isActive():
+            self.__setpoint_timer.start()
+            
+    
     def __delete_controller( self ):
-        if self.inst is not None:
-            self.off()
-            self.inst.disconnect()
-            del self.inst
-            self.inst = None
+        if self.connected:
+            self.__setpoint_timer.stop()
+            self.flush_setpoints()
+            self.__worker.submit( 'disconnect' )
+            
+            
+    def __stop_worker( self ):
+        """
+        Disconnects and waits for the worker to finish
+        """
+        if self.__worker.isRunning():
+            self.__delete_controller()
+            self.__worker.stop()
+            self.__worker.wait()
+            
+    
+    def __handle_result( self, command, result ):
+        if command in ( 'connect', 'disconnect' ):
+            self.connected = result
+            self.__update_connected_ui( result )
+            
+            if command == 'connect':
+                # setpoints changed while connecting
+                self.flush_setpoints()
+            
+            
+    def __handle_error( self, command, err ):
+        import visa # loaded by the worker, not needed before
+        
+        if command == 'connect':
+            self.connected = False
+            self.__update_connected_ui( False )
+            
+            warning = QMessageBox()
+            warning.setWindowTitle( 'Picoammeter Controller Error' )
+            warning.setText( 'Could not connect\n{}'.format( err ) )
+            warning.exec()
+            
+        elif command == 'disconnect':
+            self.connected = False
+            self.__update_connected_ui( False )
+            
+        elif isinstance( err, visa.VisaIOError ):
+            self.__handle_visa_error( err )
+            
+        else:
+            warning = QMessageBox()
+            warning.setWindowTitle( 'Picoammeter Controller Error' )
+            warning.setText( str( err ) )
+            warning.exec()
             
     
     def __update_connected_ui( self, connected ):
@@ -339,7 +550,7 @@ class PowerSupplyInterface( QWidget ):
         
 
 
-# In[3]:
+# In[4]:
 
 
 # FREEZE
@@ -17,7 +17,7 @@
 # 
 # **connect()** Connects the program to the instrument
 # 
-# **disconnect()** Disconnects the instrument from the program, closing the port
+# **disconnect( close )** Disconnects the instrument from the program, returning the session to the pool, or closing it if **close** is True
 # 
 # **write( msg )** Sends **msg** to the instrument 
 # 
@@ -25,6 +25,28 @@
 # 
 # **query( msg )** Sends **msg** to the instrument and returns its response
 # 
+# **query_values( msg, columns, dtype )** Sends **msg** to the instrument and parses the comma separated response into a numpy array
+# 
+# **query_binary( msg, dtype, big_endian )** Sends **msg** to the instrument and reads its IEEE 488.2 binary block response into a numpy array
+# 
+# **execute( commands )** Sends a list of commands as a single message and returns the query responses
+# 
+# **decode( msg, response )** Decodes the response of query **msg** using the RESPONSE_TYPES of the instrument
+#
+# **probe_capabilities()** Queries the CAPABILITIES of the instrument, caching them for the session and in CAPABILITY_CACHE
+#
+# **supports( capability )** Returns if the instrument supports a capability
+# 
+# **set_error_policy( policy, interval, handler )** Sets when the error queue is checked, an **ErrorCheck** of off, batch, interval or demand
+# 
+# **check_errors()** Drains the error queue, raising an **InstrumentError** with the commands that likely caused the errors
+# 
+# **add_hook( hook )** Adds an instrumentation Hook, called before and after each communication
+# 
+# **enable_histograms()** Records per command latency histograms, returning the LatencyHistogram
+# 
+# **batch()** Context manager queuing writes and queries to be sent as a single message
+# 
 # **reset()** Sets the instruemnt to its default state
 # 
 # **init()** Initializes the instrument for a measurement
@@ -36,11 +58,30 @@
 # 
 # **timeout** The communication timeout of the instrument [Read Only]
 # 
-# **id** The manufacturer id of the instrument [Read Only]
+# **id** The manufacturer id of the instrument, queried once per session [Read Only]
+#
+# **identity** The manufacturer, model, serial and firmware of the instrument [Read Only]
+#
+# **capabilities** Dictionary of the probed CAPABILITIES of the instrument, None if not supported [Read Only]
 # 
 # **value** The current value of the instrument [Read Only]
 # 
 # **connected** Whether the instrument is connected or not [Read Only]
+# 
+# **batching** Whether a batch is in progress, queries return None until it is sent [Read Only]
+# 
+# ### Command Schema
+# Instrument classes may declare a **COMMANDS** schema, a dictionary of name to **Command**,
+# giving the header, type, range and units of each command.
+# Each becomes a method of the class, e.g. `inst.voltage_level( 5 )`, validating values before they are sent.
+# Values written through matching property paths are validated as well,
+# while undeclared paths are sent unchecked.
+# 
+# ### Response Types
+# Property queries are decoded by the **RESPONSE_TYPES** of the instrument class, and the types of its **COMMANDS**,
+# a dictionary of command header to a function of the response string, e.g. `{ '[SOUR:]VOLT[:LEV]': float }`.
+# Headers may be written in long or short form, with optional keywords in brackets.
+# Responses of untyped queries are returned as strings.
 
 # In[1]:
 
@@ -48,27 +89,234 @@
 # standard imports
 import os
 import sys
-import serial
-import re
-from enum import Enum
-from aenum import MultiValueEnum
+import atexit
+import time
+import weakref
+import threading
+import functools
+from enum import Enum, IntFlag
+from collections import deque, namedtuple
+from contextlib import contextmanager
 
 # FREEZE
 # import logging
 # logging.basicConfig( level = logging.DEBUG )
 
-# SCPI imports
-import visa
+# numpy and visa are imported when first needed, to keep imports fast
 
 
 # In[2]:
 
 
+class StatusByte( IntFlag ):
+        """
+        IEEE 488.2 status byte register, returned by *STB?
+        """
+        ERROR_QUEUE   = 4
+        QUESTIONABLE  = 8
+        MESSAGE       = 16
+        EVENT         = 32
+        REQUEST       = 64
+        OPERATION     = 128
+        
+        
+class StandardEvent( IntFlag ):
+        """
+        IEEE 488.2 standard event status register, returned by *ESR?
+        """
+        OPERATION_COMPLETE = 1
+        QUERY_ERROR        = 4
+        DEVICE_ERROR       = 8
+        EXECUTION_ERROR    = 16
+        COMMAND_ERROR      = 32
+        POWER_ON           = 128
+        
+        
+def short_form( header ):
+    """
+    Converts a command header to its short form,
+    e.g. 'source:voltage:level?' to 'SOUR:VOLT:LEV'
+    
+    Keywords are truncated to four characters,
+    or three if the fourth is a vowel.
+    """
+    keywords = []
+    for keyword in header.strip().rstrip( '?' ).upper().split( ':' ):
+        if ( not keyword ) or keyword.startswith( '*' ):
+            # common commands have no short form
+            keywords.append( keyword )
+            continue
+        
+        if ( len( keyword ) > 3 ) and ( keyword[ 3 ] in 'AEIOU' ):
+            keyword = keyword[ :3 ]
+            
+        keywords.append( keyword[ :4 ] )
+        
+    return ':'.join( keywords )
+
+
+def parse_error( response ):
+    """
+    Parses an error queue entry, e.g. '-113,"Undefined header"'
+    
+    :returns: Tuple of ( code, message ), code 0 if there is no error
+    """
+    code, _, msg = response.partition( ',' )
+    return ( int( code ), msg.strip().strip( '"' ) )
+
+
+Identity = namedtuple( 'Identity', ( 'manufacturer', 'model', 'serial', 'firmware' ) )
+
+
+def parse_identity( response ):
+    """
+    Parses an *IDN? response, e.g. 'TEKTRONIX,PWS4305,C011451,1.0'
+    
+    :returns: Identity, missing fields are empty
+    """
+    fields = [ field.strip() for field in response.strip().split( ',', 3 ) ]
+    return Identity( *( fields + [ '' ]* ( 4 - len( fields ) ) ) )
+
+
+def expand_header( pattern ):
+    """
+    Expands a command header with optional keywords in brackets
+    into the short forms of all its variants,
+    e.g. '[SOUR:]VOLT[:LEV]' to SOUR:VOLT:LEV, SOUR:VOLT, VOLT:LEV and VOLT
+    
+    :returns: Set of short form headers
+    """
+    start = pattern.find( '[' )
+    if start < 0:
+        return { short_form( pattern ) }
+    
+    end = pattern.index( ']', start )
+    head, optional, tail = pattern[ :start ], pattern[ start + 1 : end ], pattern[ end + 1: ]
+    
+    return (
+        expand_header( head + optional + tail ) |
+        expand_header( head + tail )
+    )
+
+
+class CommandNode( object ):
+        """
+        A compiled scpi command path, e.g. SOURCE:VOLT:LEVEL
+
+        Nodes are interned per instrument class, so each path is only
+        upper cased and joined once, with its query and write messages
+        precomputed, and its response decoder looked up.
+        """
+        
+        __slots__ = ( 'path', 'query_msg', 'write_prefix', 'decode', 'command', 'tree', 'children' )
+        
+        
+        def __init__( self, path, tree ):
+            header = short_form( path )
+            
+            self.path = sys.intern( path )
+            self.query_msg = path + '?'
+            self.write_prefix = path + ' '
+            self.decode = tree.types.get( header ) # response decoder, None for raw strings
+            self.command = tree.commands.get( header ) # schema Command validating values, None if not declared
+            self.tree = tree
+            self.children = {} # attribute name -> child node
+            
+            
+        def child( self, name ):
+            """
+            Returns the compiled child node for the given attribute name
+            """
+            try:
+                return self.children[ name ]
+            
+            except KeyError:
+                node = CommandNode( ':'.join( ( self.path, name.upper() ) ), self.tree )
+                self.children[ name ] = node
+                return node
+            
+            
+class CommandTree( object ):
+        """
+        The compiled command paths of an instrument class
+        """
+        
+        __slots__ = ( 'roots', 'types', 'commands', 'decoders' )
+        
+        
+        def __init__( self, types = None, commands = None ):
+            """
+            :param types: Dictionary of command header to response decoder.
+                Headers may contain optional keywords in brackets. [Default: None]
+            :param commands: Dictionary of name to schema Command [Default: None]
+            """
+            self.roots = {} # attribute name -> root node
+            self.types = {} # short form header -> decoder
+            self.commands = {} # short form header -> Command
+            self.decoders = {} # query message -> decoder
+            
+            for pattern, decoder in ( types or {} ).items():
+                for header in expand_header( pattern ):
+                    self.types[ header ] = decoder
+                    
+            for command in ( commands or {} ).values():
+                for header in expand_header( command.header ):
+                    self.commands[ header ] = command
+                    if command.query:
+                        self.types[ header ] = command.decode
+            
+            
+        def node( self, name ):
+            """
+            Returns the compiled root node for the given attribute name
+            """
+            try:
+                return self.roots[ name ]
+            
+            except KeyError:
+                node = CommandNode( name.upper(), self )
+                self.roots[ name ] = node
+                return node
+            
+            
+        def decoder( self, msg ):
+            """
+            Returns the response decoder of a query message, or None if untyped
+            """
+            try:
+                return self.decoders[ msg ]
+            
+            except KeyError:
+                decoder = self.types.get( short_form( msg.split( ' ', 1 )[ 0 ] ) )
+                self.decoders[ msg ] = decoder
+                return decoder
+            
+            
+        #--- static methods ---
+        
+        @staticmethod
+        def of( cls ):
+            """
+            Returns the command tree of an instrument class, creating it if needed
+            """
+            tree = cls.__dict__.get( '_command_tree' )
+            if tree is None:
+                tree = CommandTree( getattr( cls, 'RESPONSE_TYPES', None ), getattr( cls, 'COMMANDS', None ) )
+                setattr( cls, '_command_tree', tree )
+                
+            return tree
+        
+        
 class Property( object ):
         """
         Represents a scpi property of the instrument 
+        
+        Properties are bound to a compiled CommandNode and cached as attributes
+        of their parent, so repeated attribute hops are plain attribute lookups.
         """
         
+        __slots__ = ( '__inst', '__node', '__dict__', '__weakref__' )
+        
         #--- static variables ---
         ON  = 'ON'
         OFF = 'OFF'
@@ -77,21 +325,38 @@ class Property( object ):
         #--- class methods ---
         
         def __init__( self, inst, name ):
-            self.__inst = inst # the instrument
-            self.name = name.upper()
+            if isinstance( name, str ):
+                # compile path
+                tree = CommandTree.of( type( inst ) )
+                node = None
+                for part in name.split( ':' ):
+                    node = tree.node( part ) if ( node is None ) else node.child( part )
+                    
+                name = node
+                
+            self.__inst = weakref.ref( inst ) # the instrument, weak to avoid reference cycles
+            self.__node = name
 
             
         def __getattr__( self, name ):
-            return Property( 
-                self.__inst, 
-                ':'.join( ( self.name, name.upper() ) ) 
-            )
+            prop = Property( self.__inst(), self.__node.child( name ) )
+            self.__dict__[ name ] = prop # cache, subsequent lookups do not reach __getattr__
+            return prop
 
         
         def __call__( self, value = None ):
             if value is None:
                 # get property
-                return self.__inst.query( self.name + '?')
+                response = self.__inst().query( self.__node.query_msg )
+                if ( self.__node.decode is None ) or ( response is None ):
+                    # untyped, or queued in a batch
+                    return response
+                
+                return self.__node.decode( response.strip() )
+                
+            elif self.__node.command is not None:
+                # declared in the schema, validate
+                return self.__inst().write( self.__node.write_prefix + self.__node.command.encode( value ) )
                 
             else:
                 # set value
@@ -103,7 +368,23 @@ class Property( object ):
                     # try to convert value to string
                     value = str( value )
                     
-                return self.__inst.write( self.name + ' ' + value )
+                return self.__inst().write( self.__node.write_prefix + value )
+        
+        
+        @property
+        def name( self ):
+            """
+            The full scpi path of the property
+            """
+            return self.__node.path
+        
+        
+        @property
+        def node( self ):
+            """
+            The compiled command node of the property
+            """
+            return self.__node
         
         
         #--- static methods ---
@@ -148,6 +429,594 @@ class Property( object ):
                 return 'OFF'
 
 
+class Command( object ):
+        """
+        A command of an instrument's schema, with the type, range and units of its value
+        
+        Commands declared in the COMMANDS of an instrument class become methods of it.
+        Called without a value they query and decode the response,
+        called with a value they validate it locally before writing it.
+        Commands with type None take no value, and are sent when called.
+        
+        ps.voltage_level( 5 )
+        ps.voltage_level() # 5.0
+        ps.voltage_level( 50 ) # ValueError, nothing is sent
+        """
+        
+        __slots__ = (
+            'header', 'type', 'minimum', 'maximum', 'units', 'query', 'write', 'sequence',
+            'name', 'path', 'query_msg', 'write_prefix'
+        )
+        
+        #--- static variables ---
+        SPECIAL_VALUES = ( 'MIN', 'MINIMUM', 'MAX', 'MAXIMUM', 'DEF', 'DEFAULT' ) # accepted by numeric commands
+        
+        
+        def __init__(
+            self,
+            header,
+            type = str,
+            minimum = None,
+            maximum = None,
+            units = None,
+            query = True,
+            write = True,
+            sequence = False
+        ):
+            """
+            :param header: The command header, with optional keywords in brackets, e.g. '[SOUR:]VOLT[:LEV]'
+            :param type: The type of the value, one of float, int, bool, str, an Enum of the values,
+                a function decoding responses, or None for commands without a value [Default: str]
+            :param minimum: Minimum numeric value, None for no limit [Default: None]
+            :param maximum: Maximum numeric value, None for no limit [Default: None]
+            :param units: Units of the value [Default: None]
+            :param query: Whether the command can be queried [Default: True]
+            :param write: Whether the command can be written [Default: True]
+            :param sequence: Whether the value is a comma separated list [Default: False]
+            """
+            self.header = header
+            self.type = type
+            self.minimum = minimum
+            self.maximum = maximum
+            self.units = units
+            self.query = query and ( type is not None )
+            self.write = write
+            self.sequence = sequence
+            self.name = header
+            
+            # shortest form, without optional keywords
+            path = header
+            while '[' in path:
+                start = path.index( '[' )
+                path = path[ :start ] + path[ path.index( ']', start ) + 1: ]
+                
+            self.path = sys.intern( path.strip( ':' ) )
+            self.query_msg = self.path + '?'
+            self.write_prefix = self.path + ' '
+            
+            
+        def __set_name__( self, owner, name ):
+            self.name = name
+            
+            
+        def __get__( self, inst, owner ):
+            if inst is None:
+                return self
+            
+            return functools.partial( self.__call, inst )
+        
+        
+        def encode( self, value ):
+            """
+            Validates a value, converting it to the command argument
+            
+            :param value: The value, or a list of values if a sequence
+            :returns: The argument string
+            :raises ValueError: If the value is invalid or out of range
+            """
+            if self.sequence:
+                if isinstance( value, str ) or not hasattr( value, '__iter__' ):
+                    value = [ value ]
+                    
+                return ','.join( self.__encode( val ) for val in value )
+            
+            return self.__encode( value )
+        
+        
+        def decode( self, response ):
+            """
+            Converts a response to the command's type
+            
+            :param response: The stripped response string
+            :returns: The value, or a list of values if a sequence
+            """
+            if self.sequence:
+                return [ self.__decode( val.strip() ) for val in response.split( ',' ) ]
+            
+            return self.__decode( response )
+        
+        
+        def message( self, value = None ):
+            """
+            Returns the validated message writing a value
+            
+            :param value: The value, ignored for commands without a value [Default: None]
+            """
+            if not self.write:
+                raise Exception( 'Can not write {}, command is query only'.format( self.name ) )
+            
+            if self.type is None:
+                return self.path
+            
+            return self.write_prefix + self.encode( value )
+        
+        
+        #--- private methods ---
+        
+        def __call( self, inst, value = None ):
+            if ( value is None ) and ( self.type is not None ):
+                if not self.query:
+                    raise Exception( 'Can not query {}, command is write only'.format( self.name ) )
+                
+                response = inst.query( self.query_msg )
+                return None if ( response is None ) else self.decode( response.strip() )
+            
+            return inst.write( self.message( value ) )
+        
+        
+        def __encode( self, value ):
+            if self.type is bool:
+                try:
+                    return Property.val2state( value )
+                
+                except ValueError:
+                    raise ValueError( 'Can not set {}, {!r} is not a boolean'.format( self.name, value ) )
+                
+            if isinstance( self.type, type ) and issubclass( self.type, Enum ):
+                if isinstance( value, self.type ):
+                    return value.value
+                
+                for member in self.type:
+                    if str( value ).upper() in ( member.value.upper(), member.name ):
+                        return member.value
+                    
+                raise ValueError( 'Can not set {}, {!r} is not one of {}'.format(
+                    self.name, value, ', '.join( member.value for member in self.type )
+                ) )
+                
+            if self.type not in ( int, float ):
+                return str( value )
+            
+            if isinstance( value, str ) and ( value.strip().upper() in self.SPECIAL_VALUES ):
+                return value.strip().upper()
+            
+            try:
+                number = self.type( value )
+                
+            except ( TypeError, ValueError ):
+                raise ValueError( 'Can not set {}, {!r} is not a number'.format( self.name, value ) )
+                
+            if (
+                ( ( self.minimum is not None ) and ( number < self.minimum ) ) or
+                ( ( self.maximum is not None ) and ( number > self.maximum ) )
+            ):
+                units = '' if ( self.units is None ) else ' ' + self.units
+                raise ValueError( 'Can not set {}, {}{} is out of range [ {}, {} ]{}'.format(
+                    self.name, number, units, self.minimum, self.maximum, units
+                ) )
+                
+            return str( number )
+        
+        
+        def __decode( self, response ):
+            if self.type is bool:
+                return Property.val2bool( response )
+            
+            return self.type( response )
+
+
+# In[2]:
+
+
+class Batch( object ):
+        """
+        Collects commands to be sent to an instrument as a single message
+        
+        Commands are joined with ';', and query responses are
+        demultiplexed in order into results once the batch is sent.
+        """
+        
+        def __init__( self ):
+            self.commands = []
+            self.results  = None # query responses, set once sent
+            
+        
+        def write( self, msg ):
+            """
+            Queues a command
+            """
+            self.commands.append( msg )
+            
+            
+        def query( self, msg ):
+            """
+            Queues a query, its response is placed in results
+            """
+            self.commands.append( msg )
+            
+            
+        #--- static methods ---
+        
+        @staticmethod
+        def join( commands ):
+            """
+            Joins commands into a single program message
+            
+            Each command is made absolute, so paths do not depend on the previous command.
+            """
+            return ';'.join(
+                cmd if ( cmd[ :1 ] in ( '*', ':' ) ) else ':' + cmd
+                for cmd in commands
+            )
+        
+        
+        @staticmethod
+        def is_query( cmd ):
+            """
+            Returns if the command is a query
+            """
+            return cmd.split( ' ', 1 )[ 0 ].endswith( '?' )
+        
+        
+class ErrorCheck( Enum ):
+        """
+        When the error queue of an instrument is checked
+        
+        OFF:      Never, commands are not tracked
+        BATCH:    With each executed batch, in the same message
+        INTERVAL: After every error_interval commands
+        DEMAND:   Only when check_errors() is called
+        """
+        OFF      = 'off'
+        BATCH    = 'batch'
+        INTERVAL = 'interval'
+        DEMAND   = 'demand'
+        
+        
+# an error reported by an instrument, with the command that likely caused it, or None if unknown
+ErrorEntry = namedtuple( 'ErrorEntry', ( 'code', 'message', 'command' ) )
+
+
+class InstrumentError( Exception ):
+        """
+        Raised when an instrument reports errors
+        """
+        
+        def __init__( self, errors ):
+            """
+            :param errors: List of ErrorEntry
+            """
+            self.errors = errors
+            Exception.__init__( self, 'Instrument reported {}'.format( '; '.join(
+                '{} {}{}'.format( err.code, err.message, '' if ( err.command is None ) else ' ({})'.format( err.command ) )
+                for err in errors
+            ) ) )
+        
+        
+# In[2]:
+
+
+class Transfer( object ):
+        """
+        A traced communication with an instrument, passed to hooks
+        
+        Times are from time.perf_counter_ns().
+        """
+        
+        __slots__ = ( 'op', 'command', 'sent', 'received', 'start', 'end', 'error' )
+        
+        
+        def __init__( self, op, command ):
+            self.op = op # the instrument method, e.g. 'query'
+            self.command = command # the message sent, None for reads
+            self.sent = 0 if ( command is None ) else len( command ) # characters sent
+            self.received = 0 # characters received
+            self.start = None
+            self.end = None
+            self.error = None # the exception raised, if any
+            
+            
+        @property
+        def duration( self ):
+            """
+            Returns the duration in seconds
+            """
+            return ( self.end - self.start ) / 1e9
+        
+        
+        @property
+        def prefix( self ):
+            """
+            Returns the header of the command, e.g. 'SOUR:VOLT?' for 'SOUR:VOLT?;:OUTP 1'
+            """
+            if self.command is None:
+                return self.op
+            
+            return self.command.split( ' ', 1 )[ 0 ].split( ';', 1 )[ 0 ].lstrip( ':' ).upper()
+        
+        
+class Hook( object ):
+        """
+        Base class of instrumentation hooks, added to an instrument with add_hook()
+        
+        Hooks are called while the instrument is locked, so should return quickly.
+        """
+        
+        def pre( self, transfer ):
+            """
+            Called before the communication
+            """
+            pass
+        
+        
+        def post( self, transfer ):
+            """
+            Called after the communication, including if it raised an error
+            """
+            pass
+        
+        
+class LatencyHistogram( Hook ):
+        """
+        Histograms of the latency of each command prefix
+        
+        Latencies are binned in powers of 2 microseconds,
+        bin i counting latencies below 2^i us.
+        """
+        
+        #--- static variables ---
+        BINS = 32
+        
+        
+        def __init__( self ):
+            self.__lock = threading.Lock()
+            self.__stats = {} # prefix -> [ counts, count, total, min, max ]
+            
+            
+        def post( self, transfer ):
+            ns = transfer.end - transfer.start
+            index = min( ( ns // 1000 ).bit_length(), self.BINS - 1 )
+            
+            with self.__lock:
+                stats = self.__stats.get( transfer.prefix )
+                if stats is None:
+                    import numpy as np
+                    stats = [ np.zeros( self.BINS, dtype = np.int64 ), 0, 0, ns, ns ]
+                    self.__stats[ transfer.prefix ] = stats
+                    
+                stats[ 0 ][ index ] += 1
+                stats[ 1 ] += 1
+                stats[ 2 ] += ns
+                stats[ 3 ] = min( stats[ 3 ], ns )
+                stats[ 4 ] = max( stats[ 4 ], ns )
+                
+                
+        def dump( self ):
+            """
+            Returns the histograms
+            
+            :returns: Dictionary of prefix to statistics,
+                with count, mean, min and max in seconds,
+                and bins of upper bound in seconds to count
+            """
+            with self.__lock:
+                return {
+                    prefix: {
+                        'count': count,
+                        'mean':  total / count / 1e9,
+                        'min':   low / 1e9,
+                        'max':   high / 1e9,
+                        'bins':  {
+                            2**i / 1e6: int( n )
+                            for i, n in enumerate( counts ) if n
+                        }
+                    }
+                    for prefix, ( counts, count, total, low, high ) in self.__stats.items()
+                }
+            
+            
+        def reset( self ):
+            """
+            Clears the histograms
+            """
+            with self.__lock:
+                self.__stats.clear()
+        
+        
+# In[2]:
+
+
+class ResourcePool( object ):
+        """
+        Process wide VISA resource managers and sessions
+        
+        One resource manager is kept per backend, and sessions are kept open by resource id
+        so reconnecting reuses them instead of opening new ones.
+        A session is leased to one instrument at a time.
+        """
+        
+        def __init__( self ):
+            self.__lock = threading.Lock()
+            self.__managers = {} # backend -> resource manager
+            self.__idle = {}     # ( backend, rid ) -> open resource
+            self.__leased = {}   # ( backend, rid ) -> resource, None while opening
+            self.__info = {}     # id( resource ) -> ( resource, information kept with the session )
+            
+            
+        def manager( self, backend = '' ):
+            """
+            Returns the resource manager of the backend, creating it if needed
+            """
+            with self.__lock:
+                rm = self.__managers.get( backend )
+                if rm is None:
+                    import visa
+                    rm = visa.ResourceManager( backend )
+                    self.__managers[ backend ] = rm
+                    
+                return rm
+            
+            
+        def register_backend( self, backend, manager ):
+            """
+            Registers a resource manager to use for a backend,
+            e.g. for simulated instruments
+            
+            :param backend: The backend name
+            :param manager: An object implementing the ResourceManager interface
+            """
+            with self.__lock:
+                self.__managers[ backend ] = manager
+                
+                
+        def acquire( self, rid, backend = '' ):
+            """
+            Leases a session to the resource, reusing an open one if available
+            
+            :param rid: The resource id
+            :param backend: The pyvisa backend [Default: '']
+            :returns: The open resource
+            """
+            key = ( backend, rid )
+            rm = self.manager( backend )
+            
+            with self.__lock:
+                if key in self.__leased:
+                    raise Exception( 'Can not connect, {} is in use'.format( rid ) )
+                    
+                resource = self.__idle.pop( key, None )
+                self.__leased[ key ] = None
+            
+            try:
+                if ( resource is not None ) and ( not ResourcePool.is_open( resource ) ):
+                    with self.__lock:
+                        self.__info.pop( id( resource ), None )
+                        
+                    resource = None
+                
+                if resource is None:
+                    resource = rm.open_resource( rid )
+                    
+            except:
+                with self.__lock:
+                    del self.__leased[ key ]
+                    
+                raise
+                
+            with self.__lock:
+                self.__leased[ key ] = resource
+                
+            return resource
+        
+        
+        def leased( self, rid, backend = '' ):
+            """
+            Returns the session to a resource leased to an instrument
+            
+            :param rid: The resource id
+            :param backend: The pyvisa backend [Default: '']
+            :returns: The leased resource, or None if not leased or still opening
+            """
+            with self.__lock:
+                return self.__leased.get( ( backend, rid ) )
+            
+            
+        def release( self, resource, close = False ):
+            """
+            Returns a leased session to the pool
+            
+            :param resource: The resource returned by acquire
+            :param close: Close the session instead of keeping it open [Default: False]
+            """
+            with self.__lock:
+                for key, leased in self.__leased.items():
+                    if leased is resource:
+                        del self.__leased[ key ]
+                        break
+                        
+                else:
+                    return
+                
+                if not close:
+                    self.__idle[ key ] = resource
+                    return
+                
+                self.__info.pop( id( resource ), None )
+                
+            resource.close()
+            
+            
+        def close( self ):
+            """
+            Closes all idle sessions
+            """
+            with self.__lock:
+                idle = list( self.__idle.values() )
+                self.__idle.clear()
+                for resource in idle:
+                    self.__info.pop( id( resource ), None )
+                
+            for resource in idle:
+                try:
+                    resource.close()
+                    
+                except Exception:
+                    pass
+                
+                
+        def info( self, resource ):
+            """
+            Returns the information kept with an open session, e.g. the identity of the instrument,
+            dropped when the session is closed
+            
+            :param resource: The resource returned by acquire
+            :returns: Dictionary of the information
+            """
+            with self.__lock:
+                entry = self.__info.get( id( resource ) )
+                if ( entry is None ) or ( entry[ 0 ] is not resource ):
+                    entry = ( resource, {} )
+                    self.__info[ id( resource ) ] = entry
+                    
+                return entry[ 1 ]
+            
+            
+        #--- static methods ---
+        
+        @staticmethod
+        def is_open( resource ):
+            """
+            Returns if the resource's session is open
+            """
+            try:
+                # session throws excpetion if not connected
+                resource.session
+                return True
+            
+            except Exception as err:
+                # import only on failure, so checks during interpreter shutdown do not import
+                import visa
+                
+                if isinstance( err, visa.InvalidSession ):
+                    return False
+                
+                raise
+            
+            
+resource_pool = ResourcePool()
+atexit.register( resource_pool.close )
+
+
 # In[1]:
 
 
@@ -158,57 +1027,387 @@ class SCPI_Instrument():
     Arbitrary SCPI commands can be performed
     treating the hieracrchy of the command as attributes.
     
-    To read an property:  inst.p1.p2.p3()
-    To call a function:   inst.p1.p2( 'value' )
-    To execute a command: inst.p1.p2.p3( '' )
-    """
-  
-    #--- methods ---
+    To read an property:  inst.p1.p2.p3()
+    To call a function:   inst.p1.p2( 'value' )
+    To execute a command: inst.p1.p2.p3( '' )
+    """
+  
+    #--- static variables ---
+    
+    # response decoders of queries, command header -> function of the response string
+    # headers may contain optional keywords in brackets, e.g. '[SOUR:]VOLT[:LEV]'
+    RESPONSE_TYPES = {
+        '*STB': lambda val: StatusByte( int( val ) ),
+        '*ESR': lambda val: StandardEvent( int( val ) ),
+        '*ESE': int,
+        '*SRE': int,
+        '*OPC': int,
+        'SYST:ERR[:NEXT]': parse_error
+    }
+    
+    # schema of the instrument, name -> Command, each becoming a method of the class
+    COMMANDS = {}
+    
+    # capabilities probed once per session, name -> query, None if the query is not supported
+    CAPABILITIES = {}
+    CAPABILITY_CACHE = None # path of a JSON file caching capabilities by serial, None to only cache per session
+    PROBE_TIMEOUT = 1 # seconds, of capability queries probed one at a time
+    
+    ERROR_QUEUE_DEPTH = 4 # errors read per round trip when draining the error queue
+    TRACKED_COMMANDS = 100 # commands kept to attribute errors to
+    
+    __batch = None # active batch
+    __sent = None # commands sent since the last error check, None when not checking
+    __error_policy = ErrorCheck.OFF
+    __error_handler = None # called with errors found, raising if None
+    __hooks = () # instrumentation hooks, empty when not tracing
+    __histograms = None # latency histogram hook
+    
+    
+    #--- methods ---
+    
+      
+    def __init_subclass__( cls, **kwargs ):
+        super().__init_subclass__( **kwargs )
+        
+        # create methods from the schema, explicitly defined attributes take precedence
+        for name, command in cls.__dict__.get( 'COMMANDS', {} ).items():
+            if name not in cls.__dict__:
+                command.__set_name__( cls, name )
+                setattr( cls, name, command )
+                
+                
+    def __getattr__( self, name ):
+        prop = Property( self, CommandTree.of( type( self ) ).node( name ) )
+        if not name.startswith( '_' ):
+            # cache, subsequent lookups do not reach __getattr__
+            self.__dict__[ name ] = prop
+            
+        return prop
+        
+    
+    def __init__( self, port = None, timeout = 10, read_terminator = None, write_terminator = None, backend = '' ):
+        """
+        Creates an instance of an Instrument, to communicate with VISA instruments
+        
+        :param port: The name of the port to connect to [Default: None]
+        :param timeout: The communication timeout in seconds [Default: 10]
+        :param read_terminator: The character that terminates data being read from the instrument [Default: pyvisa default]
+        :param write_terminator: The character that terminates strings being written to the instrument [Default: pyvisa default]
+        :param backend: The pyvisa backend to use for communication
+        :returns: An Instrument communicator
+        """
+        #--- private instance vairables ---
+        self.__lock = threading.RLock() # serializes communication between threads
+        self.__backend = backend
+        self.__inst = None # the ammeter
+        self.__port = None
+        self.__rid = None # the resource id of the instrument
+        self.__timeout = timeout* 1000
+        
+        self.__read_terminator = read_terminator
+        self.__write_terminator = write_terminator
+        
+        
+        
+        # init connection
+        self.port = port
+        
+        
+    def __del__( self ):
+        """
+        Disconnects and deletes the Instrument
+        """
+        if self.connected:
+            self.disconnect()
+            
+        del self.__inst
+        
+    #--- private methods ---
+    
+    def __trace( self, op, msg, func, *args ):
+        """
+        Runs a communication function, calling the hooks around it
+        """
+        transfer = Transfer( op, msg )
+        hooks = self.__hooks
+        for hook in hooks:
+            hook.pre( transfer )
+            
+        transfer.start = time.perf_counter_ns()
+        try:
+            result = func( *args )
+            
+        except Exception as err:
+            transfer.error = err
+            raise
+            
+        else:
+            if isinstance( result, ( str, bytes ) ):
+                transfer.received = len( result )
+                
+            elif isinstance( result, list ):
+                transfer.received = sum( len( res ) + 1 for res in result ) - 1 if result else 0
+                
+            return result
+            
+        finally:
+            transfer.end = time.perf_counter_ns()
+            for hook in hooks:
+                hook.post( transfer )
+                
+                
+    def __send( self, commands ):
+        """
+        Sends commands as a single message
+        
+        :returns: List of query responses
+        """
+        msg = Batch.join( commands )
+        queries = sum( Batch.is_query( cmd ) for cmd in commands )
+        
+        if self.__hooks:
+            results = self.__trace( 'execute', msg, self.__execute, msg, queries )
+            
+        else:
+            results = self.__execute( msg, queries )
+        
+        if len( results ) != queries:
+            raise Exception( 'Expected {} responses, received {}'.format( queries, len( results ) ) )
+        
+        return results
+    
+    
+    def __send_checked( self, commands ):
+        """
+        Sends commands as a single message, reading the error queue in the same message
+        
+        :returns: List of query responses of the commands
+        """
+        depth = self.ERROR_QUEUE_DEPTH
+        results = self.__send( list( commands ) + [ 'SYST:ERR?' ]* depth )
+        results, responses = results[ :-depth ], results[ -depth: ]
+        
+        self.__sent.extend( commands )
+        errors = [ parse_error( response ) for response in responses ]
+        errors = [ err for err in errors if err[ 0 ] != 0 ]
+        if len( errors ) == depth:
+            # queue may hold more errors
+            errors += self.drain_errors()
+            
+        self.__report( errors )
+        return results
+    
+    
+    def __track( self, commands ):
+        """
+        Records sent commands, checking for errors if due
+        """
+        self.__sent.extend( commands )
+        self.__unchecked += len( commands )
+        
+        if ( self.__error_policy is ErrorCheck.INTERVAL ) and ( self.__unchecked >= self.__error_interval ):
+            self.check_errors()
+            
+            
+    def __report( self, errors ):
+        """
+        Attributes errors to the tracked commands, clearing them,
+        then raises or passes the errors to the handler
+        
+        :param errors: List of ( code, message ) read from the error queue
+        :returns: List of ErrorEntry
+        """
+        commands = []
+        if self.__sent is not None:
+            commands = list( self.__sent )
+            self.__sent.clear()
+            self.__unchecked = 0
+        
+        if not errors:
+            return []
+        
+        entries = self.attribute_errors( errors, commands )
+        if self.__error_handler is None:
+            raise InstrumentError( entries )
+        
+        self.__error_handler( entries )
+        return entries
+    
+    
+    def __valid( self, tree, cmd ):
+        """
+        Returns if a written command is valid according to the schema, True if undeclared
+        """
+        header, _, arg = cmd.partition( ' ' )
+        command = tree.commands.get( short_form( header ) )
+        if ( command is None ) or ( command.type is None ):
+            return True
+        
+        try:
+            command.encode( arg.split( ',' ) if command.sequence else arg )
+            
+        except ValueError:
+            return False
+        
+        return True
+    
+    
+    def __session_info( self ):
+        """
+        Returns the information kept with the session
+        """
+        if self.__inst is None:
+            raise Exception( 'Can not identify, instrument not connected' )
+        
+        return resource_pool.info( self.__inst )
+    
+    
+    @contextmanager
+    def __probe_timeout( self ):
+        """
+        Context manager setting the communication timeout to PROBE_TIMEOUT
+        """
+        timeout = self.__inst.timeout
+        self.__inst.timeout = self.PROBE_TIMEOUT* 1000
+        try:
+            yield
+            
+        finally:
+            self.__inst.timeout = timeout
+            
+            
+    def __probe( self, query ):
+        """
+        Queries a capability
+        
+        :returns: The response, or None if the query failed
+        """
+        try:
+            return self.query( query )
+        
+        except Exception:
+            # discard a late response, so it is not read as the response of the next query
+            self.__inst.clear()
+            return None
+            
+            
+    def __decode_capabilities( self, responses ):
+        """
+        Decodes capability responses
+        
+        :param responses: Dictionary of name to response, None if not supported
+        :returns: Dictionary of name to decoded response
+        """
+        return {
+            name: None if ( response is None ) else self.decode( self.CAPABILITIES[ name ], response )
+            for name, response in responses.items()
+        }
+    
     
-      
-    def __getattr__( self, name ):
-        return Property( self, name )
+    def __load_capabilities( self ):
+        """
+        Loads the capability responses of the instrument from CAPABILITY_CACHE,
+        if probed with the same identity and capabilities
+        
+        :returns: Dictionary of name to response, or None if not cached
+        """
+        if self.CAPABILITY_CACHE is None:
+            return None
+        
+        import json
+        
+        try:
+            with open( self.CAPABILITY_CACHE ) as f:
+                entry = json.load( f ).get( self.identity.serial )
+                
+        except ( OSError, ValueError ):
+            return None
         
+        if (
+            ( entry is None ) or
+            ( tuple( entry[ 'identity' ] ) != self.identity ) or
+            ( set( entry[ 'capabilities' ] ) != set( self.CAPABILITIES ) )
+        ):
+            return None
+        
+        return entry[ 'capabilities' ]
     
-    def __init__( self, port = None, timeout = 10, read_terminator = None, write_terminator = None, backend = '' ):
+    
+    def __store_capabilities( self, responses ):
         """
-        Creates an instance of an Instrument, to communicate with VISA instruments
+        Saves the capability responses of the instrument to CAPABILITY_CACHE, by serial
         
-        :param port: The name of the port to connect to [Default: None]
-        :param timeout: The communication timeout in seconds [Default: 10]
-        :param read_terminator: The character that terminates data being read from the instrument [Default: pyvisa default]
-        :param write_terminator: The character that terminates strings being written to the instrument [Default: pyvisa default]
-        :param backend: The pyvisa backend to use for communication
-        :returns: An Instrument communicator
+        :param responses: Dictionary of name to response, None if not supported
         """
-        #--- private instance vairables ---
-        self.__backend = backend
-        self.__rm = visa.ResourceManager( backend ) # the VISA resource manager
-        self.__inst = None # the ammeter
-        self.__port = None
-        self.__rid = None # the resource id of the instrument
-        self.__timeout = timeout* 1000
+        if self.CAPABILITY_CACHE is None:
+            return
         
-        self.__read_terminator = read_terminator
-        self.__write_terminator = write_terminator
+        import json
         
+        try:
+            with open( self.CAPABILITY_CACHE ) as f:
+                cache = json.load( f )
+                
+        except ( OSError, ValueError ):
+            cache = {}
+            
+        cache[ self.identity.serial ] = { 'identity': self.identity, 'capabilities': responses }
         
+        try:
+            directory = os.path.dirname( os.path.abspath( self.CAPABILITY_CACHE ) )
+            os.makedirs( directory, exist_ok = True )
+            
+            tmp = '{}.{}.tmp'.format( self.CAPABILITY_CACHE, os.getpid() )
+            with open( tmp, 'w' ) as f:
+                json.dump( cache, f, indent = 2 )
+                
+            os.replace( tmp, self.CAPABILITY_CACHE )
+            
+        except OSError:
+            # the cache is an optimization, probing works without it
+            pass
         
-        # init connection
-        self.port = port
         
+    def __execute( self, msg, queries ):
+        self.__inst.write( msg )
+        if queries == 0:
+            return []
         
-    def __del__( self ):
+        return self.__inst.read().split( ';' )
+    
+    
+    def __read_block( self, msg ):
         """
-        Disconnects and deletes the Instrument
+        Queries for a binary block
+        
+        :returns: The data as bytes, or the response as a string if not a binary block
         """
-        if self.connected:
-            self.disconnect()
-            
-        del self.__inst
-        del self.__rm
+        self.__inst.write( msg )
+        head = self.__inst.read_bytes( 1 )
+        if head != b'#':
+            # ascii response
+            return ( head + self.__inst.read_raw() ).decode( 'ascii' )
         
-    #--- private methods ---
+        digits = int( self.__inst.read_bytes( 1 ) )
+        if digits == 0:
+            # indefinite length block, terminated by the message end
+            data = self.__inst.read_raw()
+            term = self.__inst.read_termination
+            if term and data.endswith( term.encode( 'ascii' ) ):
+                data = data[ :-len( term ) ]
+                
+            return data
+        
+        length = int( self.__inst.read_bytes( digits ) )
+        data = self.__inst.read_bytes( length )
+        
+        # consume message terminator
+        term = self.__inst.read_termination
+        if term:
+            self.__inst.read_bytes( len( term ) )
+            
+        return data
     
     
     #--- public methods ---
@@ -223,6 +1422,23 @@ class SCPI_Instrument():
         return self.__inst
     
     
+    @property
+    def lock( self ):
+        """
+        Lock serializing communication with the instrument.
+        Hold it to perform several operations without other threads interleaving.
+        """
+        return self.__lock
+    
+    
+    @property
+    def batching( self ):
+        """
+        Whether a batch is in progress, queries return None until it is sent
+        """
+        return self.__batch is not None
+    
+    
     @property
     def port( self ):
         return self.__port
@@ -276,9 +1492,42 @@ class SCPI_Instrument():
     @property
     def id( self ):
         """
-        Returns the id of the ammeter
+        Returns the *IDN? response of the instrument, queried once per session
+        """
+        with self.__lock:
+            info = self.__session_info()
+            if 'idn' not in info:
+                info[ 'idn' ] = self.query( '*IDN?' ).strip()
+                
+            return info[ 'idn' ]
+        
+        
+    @property
+    def identity( self ):
+        """
+        Returns the Identity of the instrument, queried once per session
+        """
+        return parse_identity( self.id )
+    
+    
+    @property
+    def capabilities( self ):
+        """
+        Returns the capabilities of the instrument, probed once per session,
+        or loaded from CAPABILITY_CACHE if the instrument was probed before
+        
+        :returns: Dictionary of name to decoded response, None if not supported
         """
-        return self.query( '*IDN?' )
+        with self.__lock:
+            info = self.__session_info()
+            if 'capabilities' not in info:
+                responses = self.__load_capabilities()
+                if responses is None:
+                    return self.probe_capabilities()
+                
+                info[ 'capabilities' ] = self.__decode_capabilities( responses )
+                
+            return info[ 'capabilities' ]
             
           
     @property
@@ -297,76 +1546,446 @@ class SCPI_Instrument():
         if self.__inst is None:
             return False
  
-        try:
-            # session throws excpetion if not connected
-            self.__inst.session
-            return True
-        
-        except visa.InvalidSession:
-            return False
+        return ResourcePool.is_open( self.__inst )
         
         
     def connect( self ):
         """
-        Connects to the instrument on the given port
+        Connects to the instrument on the given port,
+        leasing an open session from the resource pool if available
         """
         if self.__inst is None:
-            self.__inst = self.__rm.open_resource( self.rid )
-            self.__inst.timeout = self.__timeout
+            inst = resource_pool.acquire( self.rid, self.__backend )
+            inst.timeout = self.__timeout
             
             # set terminators
             if self.__read_terminator is not None:
-                self.__inst.read_termination = self.__read_terminator
+                inst.read_termination = self.__read_terminator
                 
             if self.__write_terminator is not None:
-                self.__inst.write_termination = self.__write_terminator
+                inst.write_termination = self.__write_terminator
+                
+            self.__inst = inst
             
-        else:
-            self.__inst.open()
+        if 'idn' in self.__session_info():
+            # identity known, place instrument in remote control without a query
+            self.write( 'SYST:REM' )
             
-        self.id # place instrument in remote control
+        else:
+            self.id # place instrument in remote control
         
         
-    def disconnect( self ):
+    def disconnect( self, close = False ):
         """
-        Disconnects from the instrument, and returns local control
+        Disconnects from the instrument, and returns local control.
+        
+        :param close: Close the session, releasing the instrument to other processes,
+            instead of returning it to the resource pool to be reused [Default: False]
         """
         if self.__inst is not None:
-            self.syst.loc( '' )
-            self.__inst.close()
+            try:
+                self.write( 'SYST:LOC' ) # directly, properties may be cleared during garbage collection
+                
+            finally:
+                resource_pool.release( self.__inst, close = close )
+                self.__inst = None
             
             
     def write( self, msg ):
         """
         Delegates write to resource
         """
-        if self.__inst is None:
-            raise Exception( 'Can not write, instrument not connected.' )
-            return
+        with self.__lock:
+            if self.__batch is not None:
+                return self.__batch.write( msg )
             
-        return self.__inst.write( msg )
+            if self.__inst is None:
+                raise Exception( 'Can not write, instrument not connected.' )
+                
+            if self.__hooks:
+                result = self.__trace( 'write', msg, self.__inst.write, msg )
+                
+            else:
+                result = self.__inst.write( msg )
+                
+            if self.__sent is not None:
+                self.__track( ( msg, ) )
+                
+            return result
             
             
     def read( self ):
         """
         Delegates read to resource
         """
-        if self.__inst is None:
-            raise Exception( 'Can not read, instrument not connected' )
-            return
+        with self.__lock:
+            if self.__inst is None:
+                raise Exception( 'Can not read, instrument not connected' )
+                
+            if self.__hooks:
+                return self.__trace( 'read', None, self.__inst.read )
             
-        return self.__inst.read()
+            return self.__inst.read()
     
     
     def query( self, msg ):
         """
         Delegates query to resource
         """
-        if self.__inst is None:
-            raise Exception( 'Can not query, instrument not connected' )
+        with self.__lock:
+            if self.__batch is not None:
+                return self.__batch.query( msg )
+            
+            if self.__inst is None:
+                raise Exception( 'Can not query, instrument not connected' )
+            
+            if self.__hooks:
+                result = self.__trace( 'query', msg, self.__inst.query, msg )
+                
+            else:
+                result = self.__inst.query( msg )
+                
+            if self.__sent is not None:
+                self.__track( ( msg, ) )
+                
+            return result
+    
+    
+    def execute( self, commands ):
+        """
+        Sends a list of commands as a single message
+        
+        :param commands: List of commands and queries to send
+        :returns: List of query responses, in order
+        """
+        if len( commands ) == 0:
+            return []
+        
+        with self.__lock:
+            if self.__inst is None:
+                raise Exception( 'Can not execute, instrument not connected' )
+            
+            if self.__error_policy is ErrorCheck.BATCH:
+                return self.__send_checked( commands )
+            
+            results = self.__send( commands )
+            if self.__sent is not None:
+                self.__track( commands )
+                
+            return results
+    
+    
+    def set_error_policy( self, policy, interval = 10, handler = None ):
+        """
+        Sets when the error queue of the instrument is checked
+        
+        Sent commands are tracked between checks, so errors can be attributed
+        to the commands that likely caused them.
+        The error queue is drained in a single round trip, or none with ErrorCheck.BATCH.
+        
+        :param policy: An ErrorCheck, or its value, e.g. 'batch'
+        :param interval: Commands between checks, for ErrorCheck.INTERVAL [Default: 10]
+        :param handler: Function called with the list of ErrorEntry found.
+            If None an InstrumentError is raised. [Default: None]
+        """
+        policy = ErrorCheck( policy )
+        
+        with self.__lock:
+            self.__error_policy = policy
+            self.__error_interval = interval
+            self.__error_handler = handler
+            self.__unchecked = 0 # commands sent since the last check
+            self.__sent = None if ( policy is ErrorCheck.OFF ) else deque( maxlen = self.TRACKED_COMMANDS )
+            
+            
+    @property
+    def error_policy( self ):
+        """
+        Returns the ErrorCheck policy
+        """
+        return self.__error_policy
+    
+    
+    def drain_errors( self ):
+        """
+        Reads the error queue, ERROR_QUEUE_DEPTH errors per round trip
+        
+        :returns: List of ( code, message ), empty if no errors
+        """
+        errors = []
+        with self.__lock:
+            if self.__inst is None:
+                raise Exception( 'Can not read errors, instrument not connected' )
+            
+            while True:
+                for response in self.__send( [ 'SYST:ERR?' ]* self.ERROR_QUEUE_DEPTH ):
+                    error = parse_error( response )
+                    if error[ 0 ] == 0:
+                        return errors
+                    
+                    errors.append( error )
+                    
+                    
+    def check_errors( self ):
+        """
+        Drains the error queue, attributing errors to the commands sent since the last check.
+        Raises an InstrumentError if any are found, unless a handler is set.
+        
+        :returns: List of ErrorEntry
+        """
+        with self.__lock:
+            return self.__report( self.drain_errors() )
+        
+        
+    def attribute_errors( self, errors, commands ):
+        """
+        Attributes errors to the commands that likely caused them
+        
+        The error queue does not identify commands, so errors are matched in order
+        to commands of the kind raising their class of error:
+        command errors (-100 to -199) to any command, preferring undeclared headers,
+        execution errors (-200 to -299) to writes, preferring values the schema rejects,
+        and query errors (-400 to -499) to queries.
+        Other errors are not attributed.
+        
+        :param errors: List of ( code, message ), in the order reported
+        :param commands: List of commands sent, in order
+        :returns: List of ErrorEntry
+        """
+        tree = CommandTree.of( type( self ) )
+        
+        entries = []
+        position = 0 # errors are reported in order, so later errors match later commands
+        for code, msg in errors:
+            if -199 <= code <= -100:
+                candidates = [
+                    index for index, cmd in enumerate( commands )
+                    if short_form( cmd.split( ' ', 1 )[ 0 ] ) not in tree.types
+                    and short_form( cmd.split( ' ', 1 )[ 0 ] ) not in tree.commands
+                ] or list( range( len( commands ) ) )
+                
+            elif -299 <= code <= -200:
+                writes = [ index for index, cmd in enumerate( commands ) if not Batch.is_query( cmd ) ]
+                candidates = [
+                    index for index in writes if not self.__valid( tree, commands[ index ] )
+                ] or writes
+                
+            elif -499 <= code <= -400:
+                candidates = [ index for index, cmd in enumerate( commands ) if Batch.is_query( cmd ) ]
+                
+            else:
+                candidates = []
+                
+            later = [ index for index in candidates if index >= position ]
+            if later:
+                position = later[ 0 ] + 1
+                command = commands[ later[ 0 ] ]
+                
+            elif candidates:
+                command = commands[ candidates[ -1 ] ]
+                
+            else:
+                command = None
+                
+            entries.append( ErrorEntry( code, msg, command ) )
+            
+        return entries
+    
+    
+    def decode( self, msg, response ):
+        """
+        Decodes the response of a query using RESPONSE_TYPES,
+        e.g. for responses returned by execute()
+        
+        :param msg: The query sent
+        :param response: The response string
+        :returns: The decoded response, or the stripped response if the query is untyped
+        """
+        decoder = CommandTree.of( type( self ) ).decoder( msg )
+        response = response.strip()
+        
+        return response if ( decoder is None ) else decoder( response )
+    
+    
+    def probe_capabilities( self ):
+        """
+        Probes the CAPABILITIES of the instrument, updating the session and CAPABILITY_CACHE
+        
+        The queries are sent as a single message, then one at a time if it fails,
+        all with PROBE_TIMEOUT, unsupported queries having a None result.
+        
+        :returns: Dictionary of name to decoded response, None if not supported
+        """
+        with self.__lock:
+            info = self.__session_info()
+            names = list( self.CAPABILITIES )
+            queries = [ self.CAPABILITIES[ name ] for name in names ]
+            
+            with self.__probe_timeout():
+                try:
+                    # not an override, which may have side effects such as invalidating caches
+                    responses = SCPI_Instrument.execute( self, queries )
+                    
+                except Exception:
+                    # discard a late response, so it is not read as the response of a single query
+                    self.__inst.clear()
+                    responses = [ self.__probe( query ) for query in queries ]
+                    
+                    # clear the errors of unsupported queries
+                    self.write( '*CLS' )
+                    
+            responses = dict( zip( names, responses ) )
+            self.__store_capabilities( responses )
+            
+            info[ 'capabilities' ] = self.__decode_capabilities( responses )
+            return info[ 'capabilities' ]
+        
+        
+    def supports( self, capability ):
+        """
+        Returns if the instrument supports a capability
+        
+        :param capability: Name of the capability in CAPABILITIES
+        """
+        return self.capabilities.get( capability ) is not None
+    
+    
+    def query_values( self, msg = 'READ?', columns = None, dtype = float ):
+        """
+        Queries the instrument and parses the comma separated response into an array
+        
+        :param msg: The query to send [Default: 'READ?']
+        :param columns: Number of values per reading, e.g. 2 for pairs.
+            If None a flat array is returned. [Default: None]
+        :param dtype: The data type of the values [Default: float]
+        :returns: A numpy array of the values
+        """
+        return SCPI_Instrument.parse_values( self.query( msg ), columns, dtype )
+    
+    
+    def query_binary( self, msg, dtype = 'f4', big_endian = True, fallback = True ):
+        """
+        Queries the instrument for an IEEE 488.2 binary block, #<n><length><data>
+        
+        The data is exposed as a numpy array viewing the received bytes, without copying,
+        so the array is read only.
+        The data format must be set on the instrument beforehand, e.g. FORM:DATA REAL,32
+        
+        :param msg: The query to send
+        :param dtype: The data type of the values [Default: 'f4']
+        :param big_endian: Whether the data is big endian, as is the SCPI default [Default: True]
+        :param fallback: Parse the response as comma separated values if the instrument
+            does not respond with a binary block [Default: True]
+        :returns: A numpy array of the values
+        """
+        import numpy as np
+        
+        with self.__lock:
+            if self.__inst is None:
+                raise Exception( 'Can not query, instrument not connected' )
+            
+            dtype = np.dtype( dtype ).newbyteorder( '>' if big_endian else '<' )
+            
+            if self.__hooks:
+                data = self.__trace( 'query_binary', msg, self.__read_block, msg )
+                
+            else:
+                data = self.__read_block( msg )
+                
+        if isinstance( data, str ):
+            # ascii response
+            if not fallback:
+                raise Exception( 'Expected binary block, received {}'.format( data[ :20 ] ) )
+            
+            return SCPI_Instrument.parse_values( data, dtype = dtype.newbyteorder( '=' ) )
+        
+        return np.frombuffer( data, dtype = dtype )
+    
+    
+    @contextmanager
+    def batch( self ):
+        """
+        Queues writes and queries, sending them as a single message on exit.
+        Queries return None while batching, their responses are placed in
+        the batch's results.
+        Other threads wait for the batch to be sent before communicating.
+        
+        with inst.batch() as b:
+            inst.source.volt.level( 5 )
+            inst.output.state( 'ON' )
+            inst.source.volt.level()
+            
+        b.results # [ '5.000' ]
+        """
+        with self.__lock:
+            if self.__batch is not None:
+                raise Exception( 'Can not batch, batch already in progress' )
+                
+            batch = Batch()
+            self.__batch = batch
+            try:
+                yield batch
+                
+            finally:
+                self.__batch = None
+                
+            batch.results = self.execute( batch.commands )
+            
+        
+    def add_hook( self, hook ):
+        """
+        Adds an instrumentation hook, called around each communication
+        
+        :param hook: A Hook
+        """
+        with self.__lock:
+            self.__hooks = self.__hooks + ( hook, )
+            
+            
+    def remove_hook( self, hook ):
+        """
+        Removes an instrumentation hook
+        
+        :param hook: The Hook to remove
+        """
+        with self.__lock:
+            self.__hooks = tuple( h for h in self.__hooks if h is not hook )
+            
+            
+    @property
+    def hooks( self ):
+        return self.__hooks
+    
+    
+    @property
+    def histograms( self ):
+        """
+        Returns the LatencyHistogram, or None if not enabled
+        """
+        return self.__histograms
+    
+    
+    def enable_histograms( self ):
+        """
+        Starts recording latency histograms of each command prefix
         
-        return self.__inst.query( msg )
+        :returns: The LatencyHistogram, use dump() and reset() to access it
+        """
+        if self.__histograms is None:
+            self.__histograms = LatencyHistogram()
+            self.add_hook( self.__histograms )
             
+        return self.__histograms
+    
+    
+    def disable_histograms( self ):
+        """
+        Stops recording latency histograms
+        """
+        if self.__histograms is not None:
+            self.remove_hook( self.__histograms )
+            self.__histograms = None
+        
         
     def reset( self ):
         """
@@ -380,6 +1999,35 @@ class SCPI_Instrument():
         Initialize the instrument
         """
         return self.write( 'INIT' )
+    
+    
+    #--- static methods ---
+    
+    @staticmethod
+    def parse_values( response, columns = None, dtype = float ):
+        """
+        Parses a comma separated response into a numpy array
+        
+        Parsing is done by numpy directly from the string,
+        avoiding splitting and converting each value in Python.
+        
+        :param response: The response string, e.g. '+1.0E+00,+2.0E+00'
+        :param columns: Number of values per reading, e.g. 2 for pairs.
+            If None a flat array is returned. [Default: None]
+        :param dtype: The data type of the values [Default: float]
+        :returns: A numpy array of the values
+        """
+        import numpy as np
+        
+        values = np.fromstring( response, dtype = dtype, sep = ',' )
+        
+        if columns is not None:
+            if values.size % columns != 0:
+                raise ValueError( 'Can not reshape {} values into {} columns'.format( values.size, columns ) )
+                
+            values = values.reshape( -1, columns )
+            
+        return values
         
 
 
@@ -0,0 +1,772 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Simulated Instrument
+# A simulated Tektronix PWS4305 for use without hardware
+
+# ## API
+# Importing the module registers the **BACKEND** with the resource pool,
+# so any SCPI_Instrument created with it communicates with a simulated power supply.
+#
+# #### Examples
+# `import simulated_instrument as sim`
+#
+# `ps = PowerSupply( backend = sim.BACKEND )`
+#
+# `ps.connect()`
+#
+# `ps.instrument.latency = 0.002`
+#
+# ### Simulated Power Supply
+# Implements the subset of SCPI used by PowerSupply:
+# `SOURce:VOLTage[:LEVel]`, `SOURce:CURRent[:LEVel]`, `OUTPut[:STATe]`,
+# `MEASure:VOLTage?`, `MEASure:CURRent?`, `SYSTem:ERRor?`, `SYSTem:LOCal`, `SYSTem:REMote`, `SYSTem:VERSion?`,
+# range queries, e.g. `VOLTage? MAX`, `*IDN?`, `*RST`, `*CLS`, `*OPC?`, `*SAV`, `*RCL`,
+# and list mode: `[SOURce:]LIST:VOLTage`, `[SOURce:]LIST:CURRent`, `[SOURce:]LIST:WIDTh`,
+# `[SOURce:]LIST:COUNt`, `[SOURce:]LIST:STEP`, `[SOURce:]LIST:SAVe`, `[SOURce:]LIST:RCL`,
+# `[SOURce:]FUNCtion:MODE`, `TRIGger:SOURce`, `INITiate`, `ABORt`, `*TRG`
+#
+# **latency** Seconds each transfer takes
+#
+# **command_latency** Additional seconds per command in a message
+#
+# **jitter** Maximum random seconds added to each transfer
+#
+# **resistance** Resistance of the load in Ohms
+#
+# **settle_time** Time constant in seconds of the output reaching its setpoint
+#
+# **noise** Standard deviation of measurement noise, relative to the measured value
+#
+# **inject_timeout( count, late )** Causes the next **count** reads to time out,
+# if **late** the response is kept and read by the following read
+
+# In[1]:
+
+
+# standard imports
+import math
+import time
+import random
+import threading
+
+import scpi_instrument as scpi
+
+
+# In[2]:
+
+
+#--- static variables ---
+
+BACKEND = '@simulated'
+
+MAX_VOLTAGE = 30
+MAX_CURRENT = 5
+MAX_LIST_STEPS = 80
+SCPI_VERSION = '1999.0'
+LIST_SLOTS = 7
+
+# scpi keywords, ( long form, short form )
+KEYWORDS = (
+    ( 'SOURCE',    'SOUR' ),
+    ( 'VOLTAGE',   'VOLT' ),
+    ( 'CURRENT',   'CURR' ),
+    ( 'LEVEL',     'LEV'  ),
+    ( 'IMMEDIATE', 'IMM'  ),
+    ( 'AMPLITUDE', 'AMPL' ),
+    ( 'OUTPUT',    'OUTP' ),
+    ( 'STATE',     'STAT' ),
+    ( 'MEASURE',   'MEAS' ),
+    ( 'SCALAR',    'SCAL' ),
+    ( 'DC',        'DC'   ),
+    ( 'SYSTEM',    'SYST' ),
+    ( 'ERROR',     'ERR'  ),
+    ( 'VERSION',   'VERS' ),
+    ( 'NEXT',      'NEXT' ),
+    ( 'LOCAL',     'LOC'  ),
+    ( 'REMOTE',    'REM'  ),
+    ( 'LIST',      'LIST' ),
+    ( 'WIDTH',     'WIDT' ),
+    ( 'COUNT',     'COUN' ),
+    ( 'STEP',      'STEP' ),
+    ( 'SAVE',      'SAV'  ),
+    ( 'RCL',       'RCL'  ),
+    ( 'FUNCTION',  'FUNC' ),
+    ( 'MODE',      'MODE' ),
+    ( 'TRIGGER',   'TRIG' ),
+    ( 'INITIATE',  'INIT' ),
+    ( 'ABORT',     'ABOR' )
+)
+
+# keywords which may be omitted
+OPTIONAL_KEYWORDS = { 'SOURCE', 'LEVEL', 'IMMEDIATE', 'AMPLITUDE', 'STATE', 'SCALAR', 'DC', 'NEXT' }
+
+_keywords = {}
+for long, short in KEYWORDS:
+    _keywords[ long ]  = long
+    _keywords[ short ] = long
+
+
+def canonical( header ):
+    """
+    Converts a command header to its canonical form,
+    with long keywords and optional keywords removed
+
+    :param header: The command header, e.g. 'SOUR:VOLT:LEV'
+    :returns: The canonical header, e.g. 'VOLTAGE', or None if the header is not known
+    """
+    keywords = []
+    for token in header.upper().split( ':' ):
+        keyword = _keywords.get( token )
+        if keyword is None:
+            return None
+
+        if keyword not in OPTIONAL_KEYWORDS:
+            keywords.append( keyword )
+
+    return ':'.join( keywords )
+
+
+# In[3]:
+
+
+class SimulatedPowerSupply( object ):
+    """
+    A simulated Tektronix PWS4305, behaving as an open pyvisa resource
+    """
+
+    def __init__(
+        self,
+        rid,
+        latency = 0,
+        command_latency = 0,
+        jitter = 0,
+        resistance = 10,
+        settle_time = 0,
+        noise = 0
+    ):
+        """
+        :param rid: The resource id
+        :param latency: Seconds each transfer takes [Default: 0]
+        :param command_latency: Additional seconds per command in a message [Default: 0]
+        :param jitter: Maximum random seconds added to each transfer [Default: 0]
+        :param resistance: Resistance of the load in Ohms [Default: 10]
+        :param settle_time: Time constant in seconds of the output reaching its setpoint [Default: 0]
+        :param noise: Standard deviation of measurement noise, relative to the value [Default: 0]
+        """
+        self.resource_name = rid
+        self.latency = latency
+        self.command_latency = command_latency
+        self.jitter = jitter
+        self.resistance = resistance
+        self.settle_time = settle_time
+        self.noise = noise
+
+        # pyvisa resource attributes
+        self.timeout = 2000
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+
+        #--- private instance variables ---
+        self.__lock = threading.RLock()
+        self.__open = True
+        self.__timeouts = 0 # number of reads to fail
+        self.__late = False # whether failed reads keep the response
+        self.__output = b'' # pending response
+
+        self.__saved = {} # saved setups
+        self.__saved_lists = {} # saved lists
+        self.__errors = []
+        self.__handlers = {
+            'VOLTAGE':          self.__voltage,
+            'CURRENT':          self.__current,
+            'OUTPUT':           self.__output_state,
+            'MEASURE:VOLTAGE':  self.__measure_voltage,
+            'MEASURE:CURRENT':  self.__measure_current,
+            'SYSTEM:ERROR':     self.__error,
+            'SYSTEM:LOCAL':     self.__ignore,
+            'SYSTEM:REMOTE':    self.__ignore,
+            'SYSTEM:VERSION':   lambda arg: SCPI_VERSION,
+            '*IDN':             self.__idn,
+            '*RST':             self.__rst,
+            '*CLS':             self.__cls,
+            '*OPC':             self.__opc,
+            '*WAI':             self.__ignore,
+            '*SAV':             self.__sav,
+            '*RCL':             self.__rcl,
+            'LIST:VOLTAGE':     lambda arg: self.__list_values( 'VOLTAGE', arg, MAX_VOLTAGE ),
+            'LIST:CURRENT':     lambda arg: self.__list_values( 'CURRENT', arg, MAX_CURRENT ),
+            'LIST:WIDTH':       lambda arg: self.__list_values( 'WIDTH', arg, 60 ),
+            'LIST:COUNT':       self.__list_count,
+            'LIST:STEP':        self.__list_step,
+            'LIST:SAVE':        self.__list_save,
+            'LIST:RCL':         self.__list_recall,
+            'FUNCTION:MODE':    self.__function_mode,
+            'TRIGGER':          self.__trigger_source,
+            'INITIATE':         self.__initiate,
+            'ABORT':            self.__abort,
+            '*TRG':             self.__trigger
+        }
+
+        self.__rst()
+
+
+    #--- pyvisa resource interface ---
+
+    @property
+    def session( self ):
+        self.__check_open()
+
+        return id( self )
+
+
+    def open( self ):
+        self.__open = True
+
+
+    def close( self ):
+        self.__open = False
+
+
+    def write( self, msg ):
+        self.__check_open()
+
+        commands = [ cmd.strip() for cmd in msg.strip().split( ';' ) if cmd.strip() ]
+        self.__delay( len( commands ) )
+
+        with self.__lock:
+            responses = self.__run( commands )
+            if len( responses ):
+                self.__output = ( ';'.join( responses ) + self.read_termination ).encode( 'ascii' )
+
+        return len( msg )
+
+
+    def read_raw( self ):
+        with self.__lock:
+            self.__check_read()
+            data = self.__output
+            self.__output = b''
+
+        self.__delay()
+        return data
+
+
+    def read_bytes( self, count ):
+        with self.__lock:
+            self.__check_read()
+            data = self.__output[ :count ]
+            self.__output = self.__output[ count: ]
+
+        self.__delay()
+        return data
+
+
+    def read( self ):
+        data = self.read_raw().decode( 'ascii' )
+        if self.read_termination and data.endswith( self.read_termination ):
+            data = data[ :-len( self.read_termination ) ]
+
+        return data
+
+
+    def query( self, msg ):
+        self.write( msg )
+        return self.read()
+
+
+    def clear( self ):
+        """
+        Device clear, discarding the pending response
+        """
+        self.__check_open()
+
+        with self.__lock:
+            self.__output = b''
+
+
+    #--- simulation ---
+
+    def inject_timeout( self, count = 1, late = False ):
+        """
+        Causes the next reads to time out
+
+        :param count: Number of reads to time out [Default: 1]
+        :param late: Keep the response, to be read by the following read,
+            as if it arrived after the timeout [Default: False]
+        """
+        with self.__lock:
+            self.__timeouts += count
+            self.__late = late
+
+
+    @property
+    def setpoints( self ):
+        """
+        Returns the ( volts, amps, output ) setting
+        """
+        with self.__lock:
+            return ( self.__voltage_set, self.__current_set, self.__output_on )
+
+
+    @property
+    def errors( self ):
+        """
+        Returns the error queue
+        """
+        with self.__lock:
+            return list( self.__errors )
+
+
+    @property
+    def list_step( self ):
+        """
+        Returns the index of the running list step, or None if no list is running
+        """
+        with self.__lock:
+            if self.__list_started is None:
+                return None
+
+            now = time.monotonic() if ( self.__list_paused is None ) else self.__list_paused
+            elapsed = now - self.__list_started
+            widths = self.__list[ 'WIDTH' ]
+            if elapsed >= sum( widths )* self.__list[ 'COUNT' ]:
+                # finished, hold the last step
+                return len( widths ) - 1
+
+            elapsed %= sum( widths )
+            for index, width in enumerate( widths ):
+                elapsed -= width
+                if elapsed < 0:
+                    return index
+
+            return len( widths ) - 1
+
+
+    def target( self ):
+        """
+        Returns the ( volts, amps ) the output settles to, given the load
+        """
+        with self.__lock:
+            if not self.__output_on:
+                return ( 0.0, 0.0 )
+
+            step = self.list_step
+            if step is None:
+                voltage, current = self.__voltage_set, self.__current_set
+
+            else:
+                voltage, current = self.__list[ 'VOLTAGE' ][ step ], self.__list[ 'CURRENT' ][ step ]
+
+            if voltage / self.resistance <= current:
+                # constant voltage
+                return ( voltage, voltage / self.resistance )
+
+            # constant current
+            return ( current* self.resistance, current )
+
+
+    def output( self ):
+        """
+        Returns the ( volts, amps ) currently at the output
+        """
+        with self.__lock:
+            target = self.target()
+            if self.settle_time <= 0:
+                return target
+
+            decay = math.exp( -( time.monotonic() - self.__changed ) / self.settle_time )
+            return tuple(
+                to + ( start - to )* decay
+                for start, to in zip( self.__start, target )
+            )
+
+
+    #--- private methods ---
+
+    def __check_open( self ):
+        if not self.__open:
+            import visa
+            
+            raise visa.InvalidSession()
+
+
+    def __check_read( self ):
+        import visa
+        
+        self.__check_open()
+
+        if self.__timeouts > 0:
+            self.__timeouts -= 1
+            if not self.__late:
+                self.__output = b''
+
+            raise visa.VisaIOError( visa.constants.VI_ERROR_TMO )
+
+        if len( self.__output ) == 0:
+            # nothing to read
+            self.__push_error( -420, 'Query UNTERMINATED' )
+            raise visa.VisaIOError( visa.constants.VI_ERROR_TMO )
+
+
+    def __delay( self, commands = 0 ):
+        delay = self.latency + self.command_latency* commands
+        if self.jitter > 0:
+            delay += random.uniform( 0, self.jitter )
+
+        if delay > 0:
+            time.sleep( delay )
+
+
+    def __run( self, commands ):
+        """
+        Runs the commands of a message
+
+        :returns: List of query responses
+        """
+        responses = []
+        path = [] # current path for relative headers
+
+        for cmd in commands:
+            header, _, arg = cmd.partition( ' ' )
+            arg = arg.strip()
+
+            query = header.endswith( '?' )
+            if query:
+                header = header[ :-1 ]
+
+            if header.startswith( '*' ):
+                key = header.upper()
+
+            else:
+                if header.startswith( ':' ):
+                    header = header[ 1: ]
+                    path = []
+
+                parts = path + header.split( ':' )
+                path = parts[ :-1 ]
+                key = canonical( ':'.join( parts ) )
+
+            handler = self.__handlers.get( key )
+            if handler is None:
+                self.__push_error( -113, 'Undefined header' )
+                continue
+
+            try:
+                if query and arg and ( key in ( 'VOLTAGE', 'CURRENT' ) ):
+                    # range query, e.g. VOLT? MAX
+                    maximum = MAX_VOLTAGE if ( key == 'VOLTAGE' ) else MAX_CURRENT
+                    response = '{:.3f}'.format( self.__number( arg, maximum ) )
+
+                else:
+                    response = handler( None if query else arg )
+
+            except ValueError:
+                self.__push_error( -224, 'Illegal parameter value' )
+                continue
+
+            if query:
+                responses.append( response )
+
+        return responses
+
+
+    def __push_error( self, code, msg ):
+        self.__errors.append( '{},"{}"'.format( code, msg ) )
+
+
+    def __number( self, arg, maximum ):
+        """
+        Parses a numeric argument
+        """
+        arg = arg.upper()
+        if arg in ( 'MIN', 'MINIMUM', 'DEF', 'DEFAULT' ):
+            return 0.0
+
+        if arg in ( 'MAX', 'MAXIMUM' ):
+            return float( maximum )
+
+        value = float( arg )
+        if not ( 0 <= value <= maximum ):
+            raise ValueError( 'Out of range' )
+
+        return value
+
+
+    def __change( self, voltage = None, current = None, output = None ):
+        """
+        Changes the setpoints, starting the output settling from its current value
+        """
+        self.__start = self.output()
+        self.__changed = time.monotonic()
+
+        if voltage is not None:
+            self.__voltage_set = voltage
+
+        if current is not None:
+            self.__current_set = current
+
+        if output is not None:
+            self.__output_on = output
+
+
+    def __measured( self, index ):
+        value = self.output()[ index ]
+        if self.noise > 0:
+            value += random.gauss( 0, self.noise* abs( value ) )
+
+        return '{:.4f}'.format( value )
+
+
+    #--- commands ---
+
+    def __voltage( self, arg ):
+        if arg is None:
+            return '{:.3f}'.format( self.__voltage_set )
+
+        self.__change( voltage = self.__number( arg, MAX_VOLTAGE ) )
+
+
+    def __current( self, arg ):
+        if arg is None:
+            return '{:.3f}'.format( self.__current_set )
+
+        self.__change( current = self.__number( arg, MAX_CURRENT ) )
+
+
+    def __output_state( self, arg ):
+        if arg is None:
+            return '1' if self.__output_on else '0'
+
+        self.__change( output = scpi.Property.val2bool( arg ) )
+
+
+    def __measure_voltage( self, arg ):
+        return self.__measured( 0 )
+
+
+    def __measure_current( self, arg ):
+        return self.__measured( 1 )
+
+
+    def __error( self, arg ):
+        if len( self.__errors ) == 0:
+            return '0,"No error"'
+
+        return self.__errors.pop( 0 )
+
+
+    def __idn( self, arg ):
+        parts = self.resource_name.split( '::' )
+        serial = parts[ 3 ] if ( len( parts ) > 3 ) else '0'
+        return 'TEKTRONIX,PWS4305,{},SIMULATED'.format( serial )
+
+
+    def __rst( self, arg = None ):
+        self.__voltage_set = 0.0
+        self.__current_set = 0.0
+        self.__output_on = False
+        self.__start = ( 0.0, 0.0 )
+        self.__changed = time.monotonic()
+
+        self.__list = { 'VOLTAGE': [], 'CURRENT': [], 'WIDTH': [], 'COUNT': 1 }
+        self.__list_mode = False
+        self.__list_auto = True
+        self.__trigger_imm = True
+        self.__list_started = None # time the list started, shifted by time paused
+        self.__list_paused = None
+
+
+    def __cls( self, arg ):
+        self.__errors.clear()
+
+
+    def __opc( self, arg ):
+        return '1'
+
+
+    def __sav( self, arg ):
+        self.__saved[ int( arg ) ] = ( self.__voltage_set, self.__current_set )
+
+
+    def __rcl( self, arg ):
+        voltage, current = self.__saved.get( int( arg ), ( 0.0, 0.0 ) )
+        self.__change( voltage = voltage, current = current, output = False )
+
+
+    def __ignore( self, arg ):
+        pass
+
+
+    #--- list mode ---
+
+    def __list_values( self, name, arg, maximum ):
+        if arg is None:
+            return ','.join( '{:.3f}'.format( val ) for val in self.__list[ name ] )
+
+        values = [ self.__number( val, maximum ) for val in arg.split( ',' ) ]
+        if len( values ) > MAX_LIST_STEPS:
+            raise ValueError( 'Too many steps' )
+
+        self.__list[ name ] = values
+
+
+    def __list_count( self, arg ):
+        if arg is None:
+            return str( self.__list[ 'COUNT' ] )
+
+        count = int( arg )
+        if count < 1:
+            raise ValueError( 'Out of range' )
+
+        self.__list[ 'COUNT' ] = count
+
+
+    def __list_step( self, arg ):
+        if arg is None:
+            return 'AUTO' if self.__list_auto else 'ONCE'
+
+        arg = arg.upper()
+        if arg not in ( 'AUTO', 'ONCE' ):
+            raise ValueError( 'Invalid step mode' )
+
+        auto = ( arg == 'AUTO' )
+        if ( self.__list_started is not None ) and ( auto != self.__list_auto ):
+            # stepping once holds the running step until triggered
+            if auto:
+                self.__list_started += time.monotonic() - self.__list_paused
+                self.__list_paused = None
+
+            else:
+                self.__list_paused = time.monotonic()
+
+        self.__list_auto = auto
+
+
+    def __list_save( self, arg ):
+        slot = int( arg )
+        if not ( 1 <= slot <= LIST_SLOTS ):
+            raise ValueError( 'Out of range' )
+
+        self.__saved_lists[ slot ] = dict( self.__list )
+
+
+    def __list_recall( self, arg ):
+        slot = int( arg )
+        if slot not in self.__saved_lists:
+            raise ValueError( 'Empty slot' )
+
+        self.__list = dict( self.__saved_lists[ slot ] )
+
+
+    def __function_mode( self, arg ):
+        if arg is None:
+            return 'LIST' if self.__list_mode else 'FIX'
+
+        arg = arg.upper()
+        if arg not in ( 'FIX', 'FIXED', 'LIST' ):
+            raise ValueError( 'Invalid mode' )
+
+        self.__list_mode = ( arg == 'LIST' )
+        if not self.__list_mode:
+            self.__abort()
+
+
+    def __trigger_source( self, arg ):
+        if arg is None:
+            return 'IMM' if self.__trigger_imm else 'BUS'
+
+        arg = arg.upper()
+        if arg not in ( 'IMM', 'IMMEDIATE', 'BUS' ):
+            raise ValueError( 'Invalid trigger source' )
+
+        self.__trigger_imm = arg.startswith( 'IMM' )
+
+
+    def __initiate( self, arg ):
+        if not self.__list_mode:
+            return
+
+        steps = len( self.__list[ 'VOLTAGE' ] )
+        if ( steps == 0 ) or any( len( self.__list[ name ] ) != steps for name in ( 'CURRENT', 'WIDTH' ) ):
+            self.__push_error( -221, 'Settings conflict' )
+            return
+
+        self.__change()
+        self.__list_started = time.monotonic()
+        self.__list_paused = None if self.__list_auto else self.__list_started
+
+
+    def __abort( self, arg = None ):
+        if self.__list_started is not None:
+            self.__change()
+
+        self.__list_started = None
+        self.__list_paused = None
+
+
+    def __trigger( self, arg ):
+        if ( self.__list_paused is None ) or ( self.__list_started is None ):
+            return
+
+        # advance to the start of the next step
+        total = sum( self.__list[ 'WIDTH' ] )
+        repetition = ( self.__list_paused - self.__list_started ) // total
+        start = repetition* total + sum( self.__list[ 'WIDTH' ][ :self.list_step + 1 ] )
+        self.__list_started = self.__list_paused - start
+
+
+# In[4]:
+
+
+class SimulatedResourceManager( object ):
+    """
+    A resource manager opening simulated power supplies
+
+    Supplies keep their state between connections.
+    """
+
+    def __init__( self ):
+        self.__lock = threading.Lock()
+        self.devices = {} # resource id -> SimulatedPowerSupply
+
+
+    def add( self, rid, **options ):
+        """
+        Adds a simulated power supply
+
+        :param rid: The resource id
+        :param options: Options of the SimulatedPowerSupply
+        :returns: The SimulatedPowerSupply
+        """
+        with self.__lock:
+            device = SimulatedPowerSupply( rid, **options )
+            self.devices[ rid ] = device
+            return device
+
+
+    def list_resources( self, query = '?*::INSTR' ):
+        with self.__lock:
+            return tuple( self.devices.keys() )
+
+
+    def open_resource( self, rid, **kwargs ):
+        with self.__lock:
+            device = self.devices.get( rid )
+
+        if device is None:
+            device = self.add( rid )
+
+        device.open()
+        return device
+
+
+    def close( self ):
+        pass
+
+
+# In[5]:
+
+
+manager = SimulatedResourceManager()
+scpi.resource_pool.register_backend( BACKEND, manager )
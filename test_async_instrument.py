@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Async Instrument Tests
+# Checks AsyncPowerSupply against the simulated backend
+#
+# Run with `python -m pytest test_async_instrument.py`
+
+# In[1]:
+
+
+import asyncio
+
+import async_instrument as ai
+import power_supply_controller as psc
+import simulated_instrument as sim
+
+
+# In[2]:
+
+
+def test_output_state_and_property_path():
+    rid = 'USB0::0x0699::0x0392::TEST008::INSTR'
+    sim.manager.add( rid )
+
+    async def run():
+        ps = ai.AsyncPowerSupply( psc.PowerSupply( rid = rid, backend = sim.BACKEND ) )
+        await ps.connect()
+        try:
+            await ps.set_output_state( True )
+            assert await ps.output_state()
+
+            # dynamic scpi property paths still resolve
+            assert await ps.output.state()
+            await ps.set_output_state( False )
+            assert not await ps.output.state()
+
+        finally:
+            await ps.disconnect( close = True )
+            ps.close()
+
+    asyncio.run( run() )
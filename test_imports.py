@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Import Tests
+# Checks that importing the controller modules stays within benchmarks.IMPORT_BUDGET
+# and does not load heavy dependencies
+#
+# Run with `python -m pytest test_imports.py`
+
+# In[1]:
+
+
+import benchmarks
+
+
+def test_imports():
+    failures = benchmarks.check_imports()
+    assert failures == [], '\n'.join( failures )
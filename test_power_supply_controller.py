@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Power Supply Controller Tests
+# Checks PowerSupply against the simulated backend
+#
+# Run with `python -m pytest test_power_supply_controller.py`
+
+# In[1]:
+
+
+import pytest
+
+import power_supply_controller as psc
+import simulated_instrument as sim
+
+
+# In[2]:
+
+
+@pytest.fixture
+def cached_supply():
+    rid = 'USB0::0x0699::0x0392::TEST010::INSTR'
+    sim.manager.add( rid )
+
+    ps = psc.PowerSupply( rid = rid, backend = sim.BACKEND, cache = 60 )
+    ps.connect()
+    yield ps
+    ps.disconnect()
+
+
+# In[3]:
+
+
+def test_cache_writes_range_values( cached_supply ):
+    cached_supply.voltage = 5
+    assert cached_supply.voltage == 5
+
+    cached_supply.voltage = 'MAX'
+    assert cached_supply.voltage == psc.PowerSupply.MAX_VOLTAGE
+
+    cached_supply.current = 'MIN'
+    assert cached_supply.current == 0
+
+
+def test_cache_bypassed_while_batching( cached_supply ):
+    cached_supply.voltage = 5
+    cached_supply.current = 1
+
+    with cached_supply.batch() as batch:
+        assert cached_supply.voltage is None
+        assert cached_supply.current is None
+
+    assert [ float( value ) for value in batch.results ] == [ 5, 1 ]
+
+
+def test_probe_discards_late_response():
+    rid = 'USB0::0x0699::0x0392::TEST025::INSTR'
+    device = sim.manager.add( rid )
+
+    ps = psc.PowerSupply( rid = rid, backend = sim.BACKEND, cache = 60 )
+    ps.connect()
+    try:
+        ps.voltage = 5
+
+        # the batched probe times out, its response arriving late
+        device.inject_timeout( late = True )
+        capabilities = ps.probe_capabilities()
+
+        assert capabilities[ 'scpi_version' ] == ps.decode( 'SYST:VERS?', sim.SCPI_VERSION )
+        assert capabilities[ 'voltage_max' ] == psc.PowerSupply.MAX_VOLTAGE
+        assert capabilities[ 'current_max' ] == psc.PowerSupply.MAX_CURRENT
+        assert capabilities[ 'list' ] is not None
+
+        # probing does not invalidate the setpoint cache
+        device.inject_timeout()
+        assert ps.voltage == 5
+
+    finally:
+        ps.disconnect()
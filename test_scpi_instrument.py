@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # SCPI Instrument Tests
+# Checks batching, response parsing, session pooling, schema validation and error attribution
+# of SCPI_Instrument against the simulated backend
+#
+# Run with `python -m pytest test_scpi_instrument.py`
+
+# In[1]:
+
+
+import numpy as np
+import pytest
+
+import scpi_instrument as scpi
+import power_supply_controller as psc
+import simulated_instrument as sim
+
+
+# In[2]:
+
+
+class Recorder( scpi.Hook ):
+    """
+    Records the commands sent
+    """
+
+    def __init__( self ):
+        self.commands = []
+
+
+    def post( self, transfer ):
+        self.commands.append( transfer.command )
+
+
+class BlockSupply( sim.SimulatedPowerSupply ):
+    """
+    A simulated supply responding to CURV? with an IEEE 488.2 binary block of VALUES
+    """
+
+    VALUES = np.arange( 8, dtype = '>f4' )
+
+    def __init__( self, rid ):
+        sim.SimulatedPowerSupply.__init__( self, rid )
+        self.block = b''
+
+
+    def write( self, msg ):
+        if msg.strip() != 'CURV?':
+            return sim.SimulatedPowerSupply.write( self, msg )
+
+        data = self.VALUES.tobytes()
+        length = str( len( data ) ).encode( 'ascii' )
+        self.block = b'#' + str( len( length ) ).encode( 'ascii' ) + length + data + b'\n'
+        return len( msg )
+
+
+    def read_bytes( self, count ):
+        if not self.block:
+            return sim.SimulatedPowerSupply.read_bytes( self, count )
+
+        data, self.block = self.block[ :count ], self.block[ count: ]
+        return data
+
+
+class CountingManager( object ):
+    """
+    Resource manager counting the sessions opened
+    """
+
+    def __init__( self ):
+        self.opened = 0
+
+
+    def list_resources( self, query = '?*::INSTR' ):
+        return sim.manager.list_resources( query )
+
+
+    def open_resource( self, rid, **kwargs ):
+        self.opened += 1
+        return sim.manager.open_resource( rid, **kwargs )
+
+
+    def close( self ):
+        pass
+
+
+# In[3]:
+
+
+@pytest.fixture
+def supply( request ):
+    rid = 'USB0::0x0699::0x0392::{}::INSTR'.format( request.node.name.upper() )
+    sim.manager.add( rid )
+
+    ps = psc.PowerSupply( rid = rid, backend = sim.BACKEND )
+    ps.connect()
+    yield ps
+    ps.disconnect( close = True )
+
+
+# In[4]:
+
+
+#--- batching ---
+
+def test_execute_splits_responses( supply ):
+    responses = supply.execute( [ 'VOLT 3', 'VOLT?', 'CURR 1.5', 'CURR?', 'OUTP?' ] )
+    assert [ float( response ) for response in responses ] == [ 3, 1.5, 0 ]
+
+
+def test_execute_without_queries( supply ):
+    assert supply.execute( [ 'VOLT 2', 'CURR 1' ] ) == []
+    assert supply.execute( [] ) == []
+    assert supply.voltage == 2
+
+
+def test_batch_sends_single_message( supply ):
+    recorder = Recorder()
+    supply.add_hook( recorder )
+
+    with supply.batch() as batch:
+        supply.voltage = 4
+        supply.voltage
+        supply.current
+
+    supply.remove_hook( recorder )
+    assert len( recorder.commands ) == 1
+    assert [ float( result ) for result in batch.results ] == [ 4, 0 ]
+
+
+#--- parsing ---
+
+def test_parse_values():
+    values = scpi.SCPI_Instrument.parse_values( '+1.0E+00,-2.5E-01,3' )
+    assert values.tolist() == [ 1, -0.25, 3 ]
+
+    pairs = scpi.SCPI_Instrument.parse_values( '1,2,3,4', columns = 2 )
+    assert pairs.shape == ( 2, 2 )
+
+    with pytest.raises( ValueError ):
+        scpi.SCPI_Instrument.parse_values( '1,2,3', columns = 2 )
+
+
+def test_query_binary_block():
+    rid = 'USB0::0x0699::0x0392::BLOCK::INSTR'
+    sim.manager.devices[ rid ] = BlockSupply( rid )
+
+    ps = psc.PowerSupply( rid = rid, backend = sim.BACKEND )
+    ps.connect()
+    try:
+        values = ps.query_binary( 'CURV?' )
+        assert values.tolist() == BlockSupply.VALUES.tolist()
+
+        # message terminator consumed, the session is still in sync
+        assert float( ps.query( 'VOLT?' ) ) == 0
+
+    finally:
+        ps.disconnect( close = True )
+
+
+def test_query_binary_ascii_fallback( supply ):
+    supply.voltage = 3
+    assert supply.query_binary( 'VOLT?' ).tolist() == [ 3 ]
+
+    with pytest.raises( Exception ):
+        supply.query_binary( 'VOLT?', fallback = False )
+
+
+#--- resource pool ---
+
+def test_pool_reuses_sessions():
+    backend = '@counted'
+    manager = CountingManager()
+    scpi.resource_pool.register_backend( backend, manager )
+
+    rid = 'USB0::0x0699::0x0392::POOL::INSTR'
+    sim.manager.add( rid )
+
+    recorder = Recorder()
+    ps = psc.PowerSupply( rid = rid, backend = backend )
+    ps.add_hook( recorder )
+
+    ps.connect()
+    ps.disconnect()
+    ps.connect()
+    assert manager.opened == 1
+
+    # identity is kept with the session, not queried again
+    assert recorder.commands.count( '*IDN?' ) == 1
+
+    # sessions are leased to one instrument at a time
+    other = psc.PowerSupply( rid = rid, backend = backend )
+    with pytest.raises( Exception ):
+        other.connect()
+
+    ps.disconnect( close = True )
+    ps.connect()
+    assert manager.opened == 2
+    ps.disconnect( close = True )
+
+
+#--- schema ---
+
+def test_schema_rejects_out_of_range( supply ):
+    recorder = Recorder()
+    supply.add_hook( recorder )
+
+    with pytest.raises( ValueError ):
+        supply.voltage_level( psc.PowerSupply.MAX_VOLTAGE + 1 )
+
+    with pytest.raises( ValueError ):
+        supply.current_level( -1 )
+
+    with pytest.raises( ValueError ):
+        supply.voltage_level( 'high' )
+
+    assert recorder.commands == []
+
+    # special values are sent to the instrument
+    supply.voltage_level( 'MAX' )
+    assert supply.voltage_level() == psc.PowerSupply.MAX_VOLTAGE
+
+
+#--- errors ---
+
+def test_errors_attributed_to_commands( supply ):
+    supply.set_error_policy( 'demand' )
+
+    supply.write( 'VOLT 5' )
+    supply.write( 'BOGUS:CMD 3' )
+    supply.write( 'VOLT 50' )
+    supply.query( 'MEAS:VOLT?' )
+
+    with pytest.raises( scpi.InstrumentError ) as info:
+        supply.check_errors()
+
+    assert [ ( err.code, err.command ) for err in info.value.errors ] == [
+        ( -113, 'BOGUS:CMD 3' ),
+        ( -224, 'VOLT 50' )
+    ]
+
+    # the queue is drained
+    assert supply.check_errors() == []
+
+
+def test_batch_errors_raised( supply ):
+    supply.set_error_policy( 'batch' )
+
+    with pytest.raises( scpi.InstrumentError ) as info:
+        supply.execute( [ 'VOLT 3', 'FOO', 'MEAS:VOLT?' ] )
+
+    assert [ err.command for err in info.value.errors ] == [ 'FOO' ]